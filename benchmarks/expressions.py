@@ -0,0 +1,140 @@
+"""
+    Micro-benchmark of the compiled expressions
+
+    Compares ExpressionCache with the expressions built on every call
+    before it: boto3 Key(...) conditions and the string concatenation of
+    the former _construct_update_expression. The boto3 calls are stubbed,
+    so no table or credentials are needed.
+
+    python benchmarks/expressions.py [--number 20000]
+"""
+
+# Imports
+import argparse
+import os
+import sys
+import timeit
+
+# AWS Imports
+from boto3.dynamodb.conditions import Key
+from botocore.stub import Stubber
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ddbmodel.ddb import DDBApi, ModelSettings  # noqa: E402
+
+
+def construct_update_expression(update_attributes):
+    # _construct_update_expression before the expression cache
+    counter = 1
+    var = "#var{0}= :{1},"
+    var_key = "#var{0}"
+    update_expression = "SET "
+    attribute_value_key = ":{0}"
+
+    expression_attribute_names = {}
+    expression_attribute_values = {}
+
+    for attribute in update_attributes:
+        expression_attribute_names[var_key.format(counter)] = attribute
+        expression_attribute_values[
+            attribute_value_key.format(attribute)] = update_attributes[
+            attribute]
+        update_expression += str(var.format(counter, attribute))
+        counter += 1
+
+    return update_expression.rstrip(
+        ','), expression_attribute_names, expression_attribute_values
+
+
+def per_call(func, number):
+    return timeit.timeit(func, number=number) / number * 1e6
+
+
+def stubbed_per_call(client, operation, func, number):
+    stubber = Stubber(client)
+    for _ in range(number):
+        stubber.add_response(operation, {})
+    with stubber:
+        return per_call(func, number)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--number', type=int, default=20000)
+    number = parser.parse_args().number
+
+    api = DDBApi(ModelSettings(
+        DbTableName='users', AWSRegion='us-east-1',
+        DDB_MAX_RETRIES=0, DDB_RETRY_SLEEP_TIME=1
+    ))
+    api.partition_key = 'email'
+    api.sort_key = 'created'
+    table = api._table
+    client = table.meta.client
+
+    email, created = 'a@x.com', 1
+    item = {
+        'name': 'name', 'age': 30, 'city': 'city', 'zip': '00000',
+        'score': 10, 'active': 1
+    }
+    key = {'email': email, 'created': created}
+
+    def key_old():
+        return Key('email').eq(email) & Key('created').eq(created)
+
+    def key_new():
+        return api.key_condition(email, created)
+
+    def update_old():
+        return construct_update_expression(item)
+
+    def update_new():
+        return api._construct_update_expression(item)
+
+    def query_old():
+        return table.query(KeyConditionExpression=key_old())
+
+    def query_new():
+        return table.query(**key_new())
+
+    def update_item(construct):
+        def call():
+            expression, names, values = construct(item)
+            return table.update_item(
+                Key=key, UpdateExpression=expression,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+        return call
+
+    rows = [
+        ('key condition build', per_call(key_old, number),
+         per_call(key_new, number)),
+        ('update expression build', per_call(update_old, number),
+         per_call(update_new, number)),
+        ('Table.query (stubbed)',
+         stubbed_per_call(client, 'query', query_old, number),
+         stubbed_per_call(client, 'query', query_new, number)),
+        ('Table.update_item (stubbed)',
+         stubbed_per_call(
+             client, 'update_item',
+             update_item(construct_update_expression), number
+         ),
+         stubbed_per_call(
+             client, 'update_item',
+             update_item(api._construct_update_expression), number
+         )),
+    ]
+
+    print('{:<30}{:>12}{:>12}{:>10}'.format(
+        'us per call', 'rebuilt', 'compiled', 'speedup'
+    ))
+    for name, old, new in rows:
+        print('{:<30}{:>12.2f}{:>12.2f}{:>9.1f}x'.format(
+            name, old, new, old / new
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+    Write-Time Denormalized Aggregates
+
+    Aggregate values live in items keyed `AGG#<aggregate name>#<group
+    value>`, in the DDB_AGGREGATE_TABLE of the model if set (partition
+    key `aggregate_key`), otherwise in the model table. Only these items
+    carry the `aggregate_name` attribute, so a GSI on it is sparse and
+    lists the aggregates without touching the model items. Items sharing
+    the model table are left out of the model scans, queries and change
+    feed.
+
+    On write aggregates are updated after the item write succeeded, in
+    separate requests. An update failing past its throttling retries is
+    logged and kept in AggregateMaintainer.failed instead of failing the
+    write, the aggregate drifts until the delta is applied again.
+"""
+
+# Imports
+import logging
+from decimal import Decimal
+
+from .ddb import DDBError
+from .stream import INSERT, MODIFY, REMOVE
+
+
+COUNT = 'count'
+SUM = 'sum'
+
+AGGREGATE_KEY_PREFIX = 'AGG'
+AGGREGATE_KEY = 'aggregate_key'
+AGGREGATE_NAME = 'aggregate_name'
+AGGREGATE_GROUP = 'aggregate_group'
+AGGREGATE_VALUE = 'aggregate_value'
+
+logger = logging.getLogger('ddbmodel.aggregates')
+
+
+class Aggregate:
+    """
+        Declares an aggregate on a model
+    """
+
+    def __init__(self, function, attribute=None, group_by=None,
+                 on_write=True):
+        """Initialize Aggregate variables
+
+        Args:
+            function (str): COUNT or SUM
+            attribute (str): Attribute summed by SUM
+            group_by (str): Attribute grouping the items, the partition
+                key if None
+            on_write (bool): Maintain on save/update_row/delete_row,
+                otherwise from the change feed through AggregateMaintainer
+        """
+
+        if function not in (COUNT, SUM):
+            raise TypeError('Unknown aggregate function {}'.format(function))
+        if function == SUM and attribute is None:
+            raise TypeError('SUM aggregate requires an attribute')
+
+        self.function = function
+        self.attribute = attribute
+        self.group_by = group_by
+        self.on_write = on_write
+
+    def contribution(self, item, group_by):
+        """Returns (group value, amount) the item adds to the aggregate
+
+        Args:
+            item (dict): Item values, None for a missing item
+            group_by (str): Resolved group attribute
+        """
+
+        if not item or item.get(group_by) is None:
+            return None
+        if self.function == COUNT:
+            return item[group_by], 1
+        amount = item.get(self.attribute)
+        if amount is None:
+            return None
+        # Stored numbers come back as Decimal, which does not mix with float
+        if isinstance(amount, float):
+            amount = Decimal(str(amount))
+        return item[group_by], amount
+
+
+class AggregateMaintainer:
+    """
+        Keeps the aggregate items of a model up to date with atomic
+        ADD updates.
+    """
+
+    def __init__(self, db_adapter, aggregates, sort_key_value=None,
+                 group_by=None):
+        """Initialize AggregateMaintainer variables
+
+        Args:
+            db_adapter (DDBApi): Adapter of the table holding the
+                aggregate items
+            aggregates (dict): Aggregate per name
+            sort_key_value: Sort key value of the aggregate items, None
+                for tables without sort key
+            group_by (str): Default group attribute, the partition key of
+                db_adapter if None
+        """
+
+        self._db_adapter = db_adapter
+        self._aggregates = aggregates
+        self._sort_key_value = sort_key_value
+        self._default_group_by = group_by or db_adapter.partition_key
+        # (aggregate name, group value, delta, error) of the on write
+        # updates that failed, kept for repair up to max_failed
+        self.failed = []
+        self.max_failed = 1000
+
+    @property
+    def on_write(self):
+        return any(
+            aggregate.on_write for aggregate in self._aggregates.values()
+        )
+
+    def _group_by(self, aggregate):
+        return aggregate.group_by or self._default_group_by
+
+    def item_key(self, name, group_value):
+        key = {
+            self._db_adapter.partition_key: '{}#{}#{}'.format(
+                AGGREGATE_KEY_PREFIX, name, group_value
+            )
+        }
+        if self._db_adapter.sort_key is not None:
+            key[self._db_adapter.sort_key] = self._sort_key_value
+        return key
+
+    def deltas(self, old, new, on_write=True):
+        """Computes the change of every aggregate between two images
+
+        Args:
+            old (dict): Item before the change, None when inserted
+            new (dict): Item after the change, None when deleted
+            on_write (bool): Aggregates maintained on write or from
+                the change feed
+
+        Returns:
+            dict: delta per (aggregate name, group value)
+        """
+
+        deltas = dict()
+        for name, aggregate in self._aggregates.items():
+            if aggregate.on_write != on_write:
+                continue
+            group_by = self._group_by(aggregate)
+            for image, sign in ((old, -1), (new, 1)):
+                contribution = aggregate.contribution(image, group_by)
+                if contribution is None:
+                    continue
+                group_value, amount = contribution
+                deltas[(name, group_value)] = deltas.get(
+                    (name, group_value), 0
+                ) + sign * amount
+        return deltas
+
+    def _increment(self, name, group_value, delta):
+        self._db_adapter.increment(
+            self.item_key(name, group_value),
+            AGGREGATE_VALUE,
+            delta,
+            set_attributes={
+                AGGREGATE_NAME: name,
+                AGGREGATE_GROUP: group_value
+            }
+        )
+
+    def apply(self, deltas):
+        for (name, group_value), delta in deltas.items():
+            if delta:
+                self._increment(name, group_value, delta)
+
+    def apply_write(self, old, new):
+        """Applies the change of a write which already succeeded
+
+        Failures are logged and collected rather than raised, a retried
+        write would see no change and never apply the delta.
+        """
+
+        for (name, group_value), delta in self.deltas(
+            old, new, on_write=True
+        ).items():
+            if not delta:
+                continue
+            try:
+                self._increment(name, group_value, delta)
+            except Exception as err:
+                logger.exception(
+                    'Aggregate %s#%s missed a delta of %s',
+                    name, group_value, delta
+                )
+                if len(self.failed) < self.max_failed:
+                    self.failed.append((name, group_value, delta, err))
+
+    def retry_failed(self):
+        """Applies the collected failed updates again
+
+        Returns:
+            int: Number of updates still failing
+        """
+
+        failed, self.failed = self.failed, []
+        for name, group_value, delta, _ in failed:
+            try:
+                self._increment(name, group_value, delta)
+            except Exception as err:
+                self.failed.append((name, group_value, delta, err))
+        return len(self.failed)
+
+    def apply_events(self, events):
+        """Applies a batch of change feed events, one update per group
+
+        Args:
+            events (list): StreamEvent of the model, in shard order
+        """
+
+        deltas = dict()
+        for event in events:
+            if self.is_aggregate_item(event.keys):
+                continue
+            old = event.old.to_dict() if event.old else None
+            new = event.new.to_dict() if event.new else None
+            for group, delta in self.deltas(
+                old, new, on_write=False
+            ).items():
+                deltas[group] = deltas.get(group, 0) + delta
+        self.apply(deltas)
+
+    def register(self, consumer):
+        """Registers apply_events on a StreamConsumer of the model"""
+
+        for event_name in (INSERT, MODIFY, REMOVE):
+            consumer.on(event_name, self.apply_events)
+        return consumer
+
+    def is_aggregate_item(self, item):
+        """Checks the partition key of an item or key dict"""
+
+        partition_value = item.get(self._db_adapter.partition_key)
+        return isinstance(partition_value, str) and \
+            partition_value.startswith(AGGREGATE_KEY_PREFIX + '#')
+
+    def drop_aggregate_items(self, items):
+        return [item for item in items if not self.is_aggregate_item(item)]
+
+    def fetch(self, name, group_value):
+        """Returns the current value of an aggregate with one GetItem"""
+
+        if name not in self._aggregates:
+            raise DDBError('Unknown aggregate {}'.format(name))
+        item = self._db_adapter.get_item(self.item_key(name, group_value))
+        if not item:
+            return 0
+        return item.get(AGGREGATE_VALUE, 0)
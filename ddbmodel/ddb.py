@@ -4,12 +4,18 @@
 
 # Imports
 import abc
+import os
+import threading
 import time
+import weakref
 
 # AWS Imports
 import boto3
 import botocore
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeDeserializer
+
+from .expressions import ExpressionCache
+from .tracing import instrument_client, traced
 
 
 class DB_SettingsHelper(abc.ABC):
@@ -55,6 +61,21 @@ class DB_SettingsHelper(abc.ABC):
         self.AWSRegion = AWSRegion
 
 
+class ModelSettings(DB_SettingsHelper):
+    """
+        Settings read from the attributes of a model class. Defined at
+        module level so that the settings can be pickled.
+    """
+
+    DbTableName = None
+    DDB_MAX_RETRIES = None
+    DDB_RETRY_SLEEP_TIME = None
+    AWSRegion = None
+
+    def __init__(self, **settings):
+        self.__dict__.update(settings)
+
+
 class DDBError(Exception):
     """
         Exception Class for DynamoDB Errors
@@ -62,34 +83,167 @@ class DDBError(Exception):
     pass
 
 
+class VersionConflictError(DDBError):
+    """
+        Exception Class for writes rejected by the version check.
+        current_item holds the item stored in the table, None if the
+        item does not exist.
+    """
+
+    def __init__(self, message, current_item=None):
+        super().__init__(message)
+        self.current_item = current_item
+
+
+# Adapters of the process, reset in a forked child
+_ADAPTERS = weakref.WeakSet()
+
+
+def _reset_adapters_after_fork():
+    for adapter in list(_ADAPTERS):
+        adapter.reset_connection()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_adapters_after_fork)
+
+
+class _ResourceLease:
+    """
+        boto3 resource and Table held by one thread
+    """
+
+    __slots__ = ('resource', 'table', '__weakref__')
+
+    def __init__(self, resource, table):
+        self.resource = resource
+        self.table = table
+
+
 class DDBApi:
     """
         Generic APIs to interface with dynamodb
     """
 
-    def __init__(self, settings: DB_SettingsHelper):
+    # Key attributes of the table, filled by the model
+    partition_key = None
+    sort_key = None
+    local_index_name = None
+    local_index_partition_key = None
+    local_index_sort_key = None
+
+    def __init__(self, settings: DB_SettingsHelper, region_name=None):
         """Initialize DDBApi variables
 
         Args:
             settings (DB_SettingsHelper):
                 Settings Helper Class with required params
+            region_name (str):
+                Region of the replica to use instead of AWSRegion
         """
 
         self._settings = settings
-        self._resource = boto3.resource(
-            service_name="dynamodb",
-            region_name=self._settings.AWSRegion
+        self._region_name = region_name or self._settings.AWSRegion
+        self._expressions = ExpressionCache()
+        self._connection = None
+        self._local = threading.local()
+        self._idle_resources = []
+        self._connection_lock = threading.Lock()
+        _ADAPTERS.add(self)
+
+    def _connect(self):
+        # boto3 clients are neither picklable nor safe to share with a
+        # forked process, they are built on first use in every process
+        with self._connection_lock:
+            if self._connection is None:
+                client = boto3.client(
+                    service_name="dynamodb",
+                    region_name=self._region_name
+                )
+                instrument_client(client)
+                self._connection = client
+        return self._connection
+
+    def _connect_resource(self):
+        # Resources are not thread safe, every thread leases one. Leases
+        # go back to the idle resources when their thread ends, so short
+        # lived threads do not build a resource and connection pool each
+        with self._connection_lock:
+            if self._idle_resources:
+                resource, table = self._idle_resources.pop()
+            else:
+                resource = boto3.resource(
+                    service_name="dynamodb",
+                    region_name=self._region_name
+                )
+                instrument_client(resource.meta.client)
+                table = resource.Table(self._settings.DbTableName)
+        lease = _ResourceLease(resource, table)
+        weakref.finalize(
+            lease, self._idle_resources.append, (resource, table)
         )
+        self._local.lease = lease
+        return lease
 
-        self._client = boto3.client(
-            service_name="dynamodb",
-            region_name=self._settings.AWSRegion
-        )
-        self._table = self._resource.Table(
-            self._settings.DbTableName
-        )
+    @property
+    def _resource(self):
+        lease = getattr(self._local, 'lease', None)
+        return (lease or self._connect_resource()).resource
+
+    @property
+    def _client(self):
+        return self._connection or self._connect()
+
+    @property
+    def _table(self):
+        lease = getattr(self._local, 'lease', None)
+        return (lease or self._connect_resource()).table
+
+    def reset_connection(self):
+        """Drops the boto3 clients, rebuilt on the next call"""
+
+        self._connection = None
+        self._local = threading.local()
+        self._idle_resources = []
+        self._connection_lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_local'] = None
+        state['_idle_resources'] = None
+        state['_connection_lock'] = None
+        state['_expressions'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._idle_resources = []
+        self._connection_lock = threading.Lock()
+        self._expressions = ExpressionCache()
+        _ADAPTERS.add(self)
+
+    def key_condition(self, partition_value, sort_value=None,
+                      sort_key=True):
+        """Binds the values to the compiled key condition of the table
+
+        Args:
+            partition_value: Value of the partition key
+            sort_value: Value of the sort key
+            sort_key (bool): Include the sort key in the condition
+
+        Returns:
+            dict: Query params accepted as key_condition_expression
+        """
+
+        return self._expressions.key_condition(
+            self.partition_key,
+            self.sort_key if sort_key else None
+        ).bind(partition_value, sort_value)
 
     @classmethod
+    @traced('DDBApi.del_empty_key_values')
     def del_empty_key_values(cls, obj):
         for key, value in list(obj.items()):
             if value is None or value == '':
@@ -101,25 +255,10 @@ class DDBApi:
 
     def _construct_update_expression(self, update_attributes):
 
-        counter = 1
-        var = "#var{0}= :{1},"
-        var_key = "#var{0}"
-        update_expression = "SET "
-        attribute_value_key = ":{0}"
-
-        expression_attribute_names = {}
-        expression_attribute_values = {}
+        compiled = self._expressions.update(update_attributes)
 
-        for attribute in update_attributes:
-            expression_attribute_names[var_key.format(counter)] = attribute
-            expression_attribute_values[
-                attribute_value_key.format(attribute)] = update_attributes[
-                attribute]
-            update_expression += str(var.format(counter, attribute))
-            counter += 1
-
-        return update_expression.rstrip(
-            ','), expression_attribute_names, expression_attribute_values
+        return compiled.expression, dict(compiled.names), compiled.bind(
+            update_attributes)
 
     def _get_partition_and_sort_key(self, items):
         keys = dict()
@@ -175,15 +314,41 @@ class DDBApi:
 
             return query_key
 
+    def _version_condition(self, version_key, expected_version):
+        if expected_version is None:
+            return 'attribute_not_exists(#ver)', {'#ver': version_key}, {}
+        return '#ver = :ver_expected', {'#ver': version_key}, {
+            ':ver_expected': expected_version
+        }
+
+    def _raise_version_conflict(self, error, key):
+        # The stored item comes back in the low level format
+        item = error.response.get('Item')
+        if item is not None:
+            deserializer = TypeDeserializer()
+            item = {
+                name: deserializer.deserialize(value)
+                for name, value in item.items()
+            }
+        else:
+            item = self.get_item(key)
+
+        raise VersionConflictError(
+            'Version conflict on the item {}'.format(key),
+            current_item=item
+        )
+
     def _put_item(self, key, update_expression, update_expression_values,
-                  update_attribute_name):
+                  update_attribute_name, **kwargs):
         return self._table.update_item(
             Key=key,
             UpdateExpression=update_expression,
             ExpressionAttributeValues=update_expression_values,
-            ExpressionAttributeNames=update_attribute_name
+            ExpressionAttributeNames=update_attribute_name,
+            **kwargs
         )
 
+    @traced('DDBApi.fetch_row')
     def fetch_row(self, attributes_to_fetch, conditional_items,
                   key_condition_expression, filter_expression, sort_key=True):
 
@@ -213,7 +378,9 @@ class DDBApi:
                 )
                 return {k: response_item[k] for k in keys_to_keep}
 
-    def update_row(self, input_values):
+    @traced('DDBApi.update_row')
+    def update_row(self, input_values, version_key=None,
+                   return_values='NONE'):
 
         items = dict(input_values)
         update_keys = self._get_partition_and_sort_key(items)
@@ -222,15 +389,103 @@ class DDBApi:
             if item in update_keys:
                 del items[item]
 
+        if version_key is None:
+            update_expression, update_attribute_name, \
+                update_expression_values = \
+                self._construct_update_expression(items)
+
+            return self._put_item(
+                update_keys, update_expression,
+                update_expression_values,
+                update_attribute_name,
+                ReturnValues=return_values
+            )
+
+        # Conditional update incrementing the version of the item
+        expected_version = items.get(version_key)
+        items[version_key] = (expected_version or 0) + 1
+
         update_expression, update_attribute_name, update_expression_values \
             = self._construct_update_expression(items)
+        condition, condition_names, condition_values = \
+            self._version_condition(version_key, expected_version)
+        update_attribute_name.update(condition_names)
+        update_expression_values.update(condition_values)
 
-        return self._put_item(
-            update_keys, update_expression,
-            update_expression_values,
-            update_attribute_name
-        )
+        try:
+            return self._put_item(
+                update_keys, update_expression,
+                update_expression_values,
+                update_attribute_name,
+                ConditionExpression=condition,
+                ReturnValues=return_values,
+                ReturnValuesOnConditionCheckFailure='ALL_OLD'
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] == \
+                    "ConditionalCheckFailedException":
+                self._raise_version_conflict(e, update_keys)
+            raise
+
+    @traced('DDBApi.increment')
+    def increment(self, key, attribute, delta, set_attributes=None):
+        """Atomically adds delta to a number attribute
+
+        Args:
+            key (dict): Key of the item, created if missing
+            attribute (str): Number attribute to increment
+            delta: Amount to add, negative to decrement
+            set_attributes (dict): Attributes to SET in the same update
+        """
+
+        update_expression = 'ADD #inc :inc'
+        update_attribute_name = {'#inc': attribute}
+        update_expression_values = {':inc': delta}
+        if set_attributes:
+            set_expression, set_names, set_values = \
+                self._construct_update_expression(set_attributes)
+            update_expression = '{} {}'.format(
+                set_expression, update_expression
+            )
+            update_attribute_name.update(set_names)
+            update_expression_values.update(set_values)
+
+        retries = 0
+        max_retries = self._settings.DDB_MAX_RETRIES
+        while retries <= max_retries:
+            try:
+                return self._put_item(
+                    key, update_expression,
+                    update_expression_values,
+                    update_attribute_name
+                )
+            except botocore.exceptions.ClientError as e:
+                code = e.response["Error"]["Code"]
+                if code == "ProvisionedThroughputExceededException" \
+                        or code == "ThrottlingException":
+                    if retries == max_retries:
+                        raise DDBError(
+                            'Increment operation failed. '
+                            'Error Code: {}. Error: {}'.format(
+                                e.response["Error"]["Code"],
+                                e.response["Error"]["Message"]
+                            )
+                        )
 
+                    time.sleep(
+                        self._settings.DDB_RETRY_SLEEP_TIME ** retries
+                    )
+                    retries += 1
+                else:
+                    raise DDBError(
+                        'Increment operation failed. '
+                        'Error Code: {}. Error: {}'.format(
+                            e.response["Error"]["Code"],
+                            e.response["Error"]["Message"]
+                        )
+                    )
+
+    @traced('DDBApi.get_item')
     def get_item(self, key):
         if key is None:
             raise DDBError(
@@ -274,10 +529,13 @@ class DDBApi:
                     )
         return response
 
-    def delete_row(self, key):
+    @traced('DDBApi.delete_row')
+    def delete_row(self, key, return_values='NONE'):
         try:
 
-            response = self._table.delete_item(Key=key)
+            response = self._table.delete_item(
+                Key=key, ReturnValues=return_values
+            )
 
             if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
                 raise DDBError(
@@ -298,14 +556,30 @@ class DDBApi:
 
         return response
 
-    def add_row(self, item):
+    @traced('DDBApi.add_row')
+    def add_row(self, item, version_key=None, return_values='NONE'):
         self.del_empty_key_values(item)
 
+        put_kwargs = {'ReturnValues': return_values}
+        if version_key is not None:
+            # Conditional put incrementing the version of the item
+            expected_version = item.get(version_key)
+            item[version_key] = (expected_version or 0) + 1
+            condition, condition_names, condition_values = \
+                self._version_condition(version_key, expected_version)
+            put_kwargs.update({
+                'ConditionExpression': condition,
+                'ExpressionAttributeNames': condition_names,
+                'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
+            })
+            if condition_values:
+                put_kwargs['ExpressionAttributeValues'] = condition_values
+
         retries = 0
         max_retries = self._settings.DDB_MAX_RETRIES
         while retries <= max_retries:
             try:
-                response = self._table.put_item(Item=item)
+                response = self._table.put_item(Item=item, **put_kwargs)
                 if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
                     raise DDBError(
                         "Error trying to insert item. {}").format(
@@ -314,7 +588,14 @@ class DDBApi:
                 break
             except botocore.exceptions.ClientError as e:
                 code = e.response["Error"]["Code"]
-                if code == "ProvisionedThroughputExceededException" \
+                if code == "ConditionalCheckFailedException" \
+                        and version_key is not None:
+                    # Keep the version the caller expected
+                    item[version_key] = expected_version
+                    self._raise_version_conflict(
+                        e, self._get_partition_and_sort_key(item)
+                    )
+                elif code == "ProvisionedThroughputExceededException" \
                         or code == "ThrottlingException":
                     if retries == max_retries:
                         raise DDBError('Add operation failed. \
@@ -334,8 +615,9 @@ class DDBApi:
                         e.response["Error"]["Message"]
                     ))
 
-            return response
+        return response
 
+    @traced('DDBApi.get_item_by_secondary_index')
     def get_item_by_secondary_index(self,
                                     index_name,
                                     key_attributes,
@@ -351,13 +633,12 @@ class DDBApi:
         max_retries = self._settings.DDB_MAX_RETRIES
         while retries <= max_retries:
             try:
-                # response = self._table.get_item(Key=key).get("Item", None)
                 response = self._table.query(
                     IndexName=index_name,
-                    KeyConditionExpression=Key(
-                        key_attributes['partition_key']).eq(
-                        values['partition_key']) & Key(
-                        key_attributes['sort_key']).eq(values['sort_key'])
+                    **self._expressions.key_condition(
+                        key_attributes['partition_key'],
+                        key_attributes['sort_key']
+                    ).bind(values['partition_key'], values['sort_key'])
                 )
                 break
             except KeyError as e:
@@ -392,9 +673,23 @@ class DDBApi:
                     )
         return response
 
+    @traced('DDBApi.get_table_structure')
     def get_table_structure(self, table_name):
         return self._client.describe_table(TableName=table_name)
 
+    def get_stream_arn(self):
+        table = self.get_table_structure(
+            self._settings.DbTableName
+        )['Table']
+        if not table.get('LatestStreamArn'):
+            raise DDBError(
+                'Stream is not enabled on the table {}'.format(
+                    self._settings.DbTableName
+                )
+            )
+        return table['LatestStreamArn']
+
+    @traced('DDBApi.fetch_all_rows')
     def fetch_all_rows(self, **kwargs):
         if kwargs.get('LastEvaluatedKey', None) is None:
             return self._table.scan()
@@ -403,17 +698,36 @@ class DDBApi:
                 ExclusiveStartKey=kwargs.get('LastEvaluatedKey')
             )
 
+    @traced('DDBApi.query_db')
     def query_db(self, filter_expression, key_condition_expression):
-        if filter_expression is not None:
-            return self._table.query(
-                KeyConditionExpression=key_condition_expression,
-                FilterExpression=filter_expression
-            )
+        # Compiled key conditions come with their own placeholders
+        if isinstance(key_condition_expression, dict):
+            query_obj = dict(key_condition_expression)
         else:
-            return self._table.query(
-                KeyConditionExpression=key_condition_expression
-            )
+            query_obj = {'KeyConditionExpression': key_condition_expression}
 
+        if filter_expression is not None:
+            query_obj['FilterExpression'] = filter_expression
+
+        return self._table.query(**query_obj)
+
+    @traced('DDBApi.query_page')
+    def query_page(self, query_obj, exclusive_start_key=None):
+        params = dict(query_obj)
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+        if exclusive_start_key:
+            params['ExclusiveStartKey'] = exclusive_start_key
+        return self._table.query(**params)
+
+    @traced('DDBApi.scan_page')
+    def scan_page(self, scan_obj, exclusive_start_key=None):
+        params = dict(scan_obj)
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+        if exclusive_start_key:
+            params['ExclusiveStartKey'] = exclusive_start_key
+        return self._table.scan(**params)
+
+    @traced('DDBApi.batch_get_item')
     def batch_get_item(self, request_items, return_consumed_capacity='NONE'):
 
         resultset = []
@@ -433,6 +747,7 @@ class DDBApi:
 
         return resultset
 
+    @traced('DDBApi.query_items')
     def query_items(self, query_obj):
         limit = query_obj.get('Limit')
 
@@ -0,0 +1,113 @@
+"""
+    Compiled DynamoDB Expressions
+
+    Expression strings and attribute name maps only depend on the
+    attribute names involved, so they are built once per shape and only
+    the values are bound at call time.
+"""
+
+# Imports
+import threading
+
+
+class CompiledKeyCondition:
+    """
+        Key condition on the partition key and optionally the sort key
+    """
+
+    def __init__(self, partition_key, sort_key=None):
+        self.expression = '#pk = :pk'
+        self.names = {'#pk': partition_key}
+        self.has_sort_key = sort_key is not None
+        if self.has_sort_key:
+            self.expression += ' AND #sk = :sk'
+            self.names['#sk'] = sort_key
+
+    def bind(self, partition_value, sort_value=None):
+        """Binds the key values
+
+        Args:
+            partition_value: Value of the partition key
+            sort_value: Value of the sort key
+
+        Returns:
+            dict: Query params for KeyConditionExpression,
+            ExpressionAttributeNames and ExpressionAttributeValues
+        """
+
+        values = {':pk': partition_value}
+        if self.has_sort_key:
+            values[':sk'] = sort_value
+        return {
+            'KeyConditionExpression': self.expression,
+            'ExpressionAttributeNames': dict(self.names),
+            'ExpressionAttributeValues': values
+        }
+
+
+class CompiledUpdate:
+    """
+        SET update expression for an ordered set of attributes
+    """
+
+    def __init__(self, attributes):
+        self.attributes = tuple(attributes)
+        self.placeholders = tuple(
+            ':u{}'.format(index) for index in range(len(self.attributes))
+        )
+        self.expression = 'SET ' + ', '.join(
+            '#u{0} = :u{0}'.format(index)
+            for index in range(len(self.attributes))
+        )
+        self.names = {
+            '#u{}'.format(index): attribute
+            for index, attribute in enumerate(self.attributes)
+        }
+
+    def bind(self, update_attributes):
+        return {
+            placeholder: update_attributes[attribute]
+            for placeholder, attribute in zip(
+                self.placeholders, self.attributes
+            )
+        }
+
+
+class ExpressionCache:
+    """
+        Per table cache of the compiled expressions
+    """
+
+    def __init__(self, max_size=1024):
+        """Initialize ExpressionCache variables
+
+        Args:
+            max_size (int): Number of update shapes kept before the
+                cache is cleared
+        """
+
+        self._max_size = max_size
+        self._key_conditions = dict()
+        self._updates = dict()
+        self._lock = threading.Lock()
+
+    def key_condition(self, partition_key, sort_key=None):
+        shape = (partition_key, sort_key)
+        compiled = self._key_conditions.get(shape)
+        if compiled is None:
+            compiled = CompiledKeyCondition(partition_key, sort_key)
+            with self._lock:
+                self._key_conditions[shape] = compiled
+        return compiled
+
+    def update(self, attributes):
+        shape = tuple(attributes)
+        compiled = self._updates.get(shape)
+        if compiled is None:
+            compiled = CompiledUpdate(shape)
+            with self._lock:
+                # Update shapes come from the callers, keep them bounded
+                if len(self._updates) >= self._max_size:
+                    self._updates.clear()
+                self._updates[shape] = compiled
+        return compiled
@@ -1,7 +1,16 @@
 import sys
-from boto3.dynamodb.conditions import Key
 from dynamodb_json import json_util as db_json
-from .ddb import DDBApi, DB_SettingsHelper
+from concurrent.futures import ThreadPoolExecutor
+from .aggregates import AGGREGATE_KEY, Aggregate, AggregateMaintainer
+from .ddb import DDBApi, ModelSettings, VersionConflictError
+from .paging import PagedResult
+from .routing import ReplicaRouter
+from .stream import DDBStreamSource, ShardCheckpoint, StreamConsumer
+from .tracing import traced
+from .validation import ModelValidator
+
+# Decoding of the DynamoDB responses, timed when tracing is enabled
+loads = traced('db_json.loads')(db_json.loads)
 
 
 class Model(type):
@@ -20,16 +29,22 @@ class Model(type):
         PARTITION_KEY = PartitionKey()
         SORT_KEY = SortKey()
 
+    # Aggregates declared on the model, see ddbmodel.aggregates
+    Aggregate = Aggregate
+
     class Column:
 
         _partition_key = None
         _sort_key = None
+        _version = None
 
         def __init__(
             self,
             default_type=None,
             default_value=None,
-            key_type=None
+            key_type=None,
+            version=False,
+            required=False
         ):
             if default_type:
                 if default_value and type(default_value) != default_type:
@@ -41,6 +56,8 @@ class Model(type):
             self._default_val = default_value
             self._is_partition_key = False
             self._is_sort_key = False
+            self._is_version = False
+            self._is_required = required or key_type is not None
 
             if Model.Column._partition_key and isinstance(
                 key_type, Model.Key.PartitionKey
@@ -58,6 +75,14 @@ class Model(type):
                 Model.Column._sort_key = Model.Key.SORT_KEY
                 self._is_sort_key = True
 
+            if version:
+                if key_type is not None:
+                    raise TypeError('VERSION Can not be a KEY')
+                if Model.Column._version:
+                    raise TypeError('VERSION Can only be One')
+                Model.Column._version = True
+                self._is_version = True
+
         def get_value(self):
             return (
                 self._type(self._value) if (
@@ -81,10 +106,17 @@ class Model(type):
         def is_sort_key(self):
             return self._is_sort_key
 
+        def is_version(self):
+            return self._is_version
+
+        def is_required(self):
+            return self._is_required
+
     @classmethod
     def __prepare__(meta, name, bases, **kwds):
         meta.Column._partition_key = None
         meta.Column._sort_key = None
+        meta.Column._version = None
         return dict()
 
     def __new__(model_attr, class_name, parent_class, attributes):
@@ -95,8 +127,13 @@ class Model(type):
         # Keys and Column List
         PARTITION_KEY = None
         SORT_KEY = None
+        VERSION_KEY = None
         COLUMNS = list()
         DEFAULT_VAL_COLS = dict()
+        AGGREGATES = dict()
+        COLUMN_TYPES = dict()
+        REQUIRED_COLS = list()
+        sort_key_type = None
 
         # Filling Attributes
         for key, value in attributes.items():
@@ -105,13 +142,25 @@ class Model(type):
                     PARTITION_KEY = key
                 elif value.is_sort_key():
                     SORT_KEY = key
+                    sort_key_type = value._type
                 else:
                     COLUMNS.append(key)
                     DEFAULT_VAL_COLS[key] = value.get_default_val()
+                    if value.is_version():
+                        VERSION_KEY = key
 
                 db_columns[key] = value.get_value()
+                COLUMN_TYPES[key] = value._type
+                if value.is_required():
+                    REQUIRED_COLS.append(key)
+            elif isinstance(value, Model.Aggregate):
+                AGGREGATES[key] = value
 
         attributes.update(**db_columns)
+        user_attributes = set(attributes)
+
+        # Compiled checks of the write path
+        validator = ModelValidator(COLUMN_TYPES, REQUIRED_COLS)
 
         # Custom Methods for Class
 
@@ -184,15 +233,18 @@ class Model(type):
         # Checks if SETTINGS_CLASS is defined in class or not
         if 'SETTINGS_CLASS' not in attributes:
             try:
-                DB_Sttings = type('DB_Sttings', (DB_SettingsHelper,), {
-                    'DDB_MAX_RETRIES': attributes['DDB_MAX_RETRIES'],
-                    'DDB_RETRY_SLEEP_TIME':
-                    attributes['DDB_RETRY_SLEEP_TIME'],
-                    'DDB_ENDPOINT_URL': attributes['DDB_ENDPOINT_URL'],
-                    'DbTableName': attributes['DbTableName'],
-                    'AWSRegion': attributes['AWSRegion'],
-                })
-                settings_class = DB_Sttings()
+                settings_class = ModelSettings(
+                    DDB_MAX_RETRIES=attributes['DDB_MAX_RETRIES'],
+                    DDB_RETRY_SLEEP_TIME=attributes['DDB_RETRY_SLEEP_TIME'],
+                    DDB_ENDPOINT_URL=attributes['DDB_ENDPOINT_URL'],
+                    DbTableName=attributes['DbTableName'],
+                    AWSRegion=attributes['AWSRegion'],
+                    DDB_REPLICA_REGIONS=attributes.get('DDB_REPLICA_REGIONS'),
+                    DDB_HEDGE_PERCENTILE=attributes.get(
+                        'DDB_HEDGE_PERCENTILE'
+                    ),
+                    DDB_AGGREGATE_TABLE=attributes.get('DDB_AGGREGATE_TABLE'),
+                )
             except KeyError as err:
                 print('ERROR: Class Must define the key {}'.format(str(err)))
                 raise
@@ -201,36 +253,162 @@ class Model(type):
 
         # Initialize DB Adapter
         db_adapter = DDBApi(settings_class)
+        db_adapter.partition_key = PARTITION_KEY
+        db_adapter.sort_key = SORT_KEY
+
+        # Reads go to the fastest replica, writes stay on db_adapter
+        if getattr(settings_class, 'DDB_REPLICA_REGIONS', None):
+            read_adapter = ReplicaRouter.from_settings(
+                settings_class, db_adapter
+            )
+        else:
+            read_adapter = db_adapter
+
+        # Aggregate items go to DDB_AGGREGATE_TABLE if set, otherwise they
+        # share the table keyed by a string partition key and are left out
+        # of the scans, queries and change feed of the model
+        aggregates = None
+        shared_aggregates = None
+        aggregate_table = getattr(settings_class, 'DDB_AGGREGATE_TABLE', None)
+        if AGGREGATES and aggregate_table:
+            aggregate_adapter = DDBApi(ModelSettings(
+                DbTableName=aggregate_table,
+                AWSRegion=settings_class.AWSRegion,
+                DDB_MAX_RETRIES=settings_class.DDB_MAX_RETRIES,
+                DDB_RETRY_SLEEP_TIME=settings_class.DDB_RETRY_SLEEP_TIME
+            ))
+            aggregate_adapter.partition_key = AGGREGATE_KEY
+            aggregates = AggregateMaintainer(
+                aggregate_adapter, AGGREGATES, group_by=PARTITION_KEY
+            )
+        elif AGGREGATES:
+            if COLUMN_TYPES[PARTITION_KEY] not in (None, str):
+                raise TypeError(
+                    'AGGREGATES Need a str PARTITION KEY or a '
+                    'DDB_AGGREGATE_TABLE'
+                )
+            aggregates = shared_aggregates = AggregateMaintainer(
+                db_adapter,
+                AGGREGATES,
+                sort_key_value=(
+                    0 if sort_key_type in (int, float) else
+                    b'AGG' if sort_key_type is bytes else 'AGG'
+                ) if SORT_KEY else None
+            )
+        write_aggregates = aggregates is not None and aggregates.on_write
+
+        # Decodes the items read from the table
+        def decode_items(items):
+            if shared_aggregates is not None:
+                items = shared_aggregates.drop_aggregate_items(items)
+            return loads(items)
 
         # Save Method to save the current Instance into DB
-        attributes['save'] = lambda self, list_of_cols=None: (
-            db_adapter.add_row(
-                self.cust_dict(list_of_cols)
-            ) if list_of_cols else db_adapter.add_row(self.to_dict())
+        # With a version column the put is conditional on the version
+        def save(self, list_of_cols=None):
+            if not list_of_cols:
+                item = self.to_dict()
+            elif VERSION_KEY and VERSION_KEY not in list_of_cols:
+                item = self.cust_dict(list(list_of_cols) + [VERSION_KEY])
+            else:
+                item = self.cust_dict(list_of_cols)
+            item = validator.serialize(item)
+
+            response = db_adapter.add_row(
+                item,
+                version_key=VERSION_KEY,
+                return_values='ALL_OLD' if write_aggregates else 'NONE'
+            )
+            if VERSION_KEY:
+                self.__setattr__(VERSION_KEY, item[VERSION_KEY])
+            if write_aggregates:
+                aggregates.apply_write(response.get('Attributes'), item)
+            return response
+
+        # Mapping function to the class
+        attributes['save'] = save
+
+        # Returns the item save would send, raises ValidationError
+        attributes['validate'] = lambda self: validator.serialize(
+            self.to_dict()
         )
 
+        # Validates a batch of dicts or instances without writing them
+        # Returns the serialized items and the (index, error) rejected
+        def validate_many(self, items, partial=False):
+            return validator.validate_many(
+                [
+                    item if isinstance(item, dict) else item.to_dict()
+                    for item in items
+                ],
+                partial=partial
+            )
+
+        # Mapping function to the class
+        attributes['validate_many'] = validate_many
+
+        # Save retrying on version conflicts, merge(self, current) is
+        # called with the stored instance (None if deleted) before retrying
+        def save_with_merge(self, merge, max_attempts=3, list_of_cols=None):
+            attempt = 1
+            while True:
+                try:
+                    return self.save(list_of_cols)
+                except VersionConflictError as err:
+                    if attempt >= max_attempts:
+                        raise
+                    current = None
+                    if err.current_item is not None:
+                        current = type(self)()
+                        current.populate(**loads(err.current_item))
+                    merge(self, current)
+                    self.__setattr__(
+                        VERSION_KEY,
+                        current.__getattribute__(VERSION_KEY)
+                        if current else None
+                    )
+                    attempt += 1
+
+        # Mapping function to the class
+        attributes['save_with_merge'] = save_with_merge
+
+        # Save instances in parallel, every thread writes through its own
+        # boto3 resource. Returns (instance, error) of the failed saves,
+        # version conflicts included once the merge retries are exhausted
+        def save_many(self, instances, merge=None, max_attempts=3,
+                      max_workers=8):
+            def save_instance(instance):
+                try:
+                    if merge is None:
+                        instance.save()
+                    else:
+                        instance.save_with_merge(
+                            merge, max_attempts=max_attempts
+                        )
+                except Exception as err:
+                    return instance, err
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                return [
+                    failed
+                    for failed in executor.map(save_instance, instances)
+                    if failed is not None
+                ]
+
+        # Mapping function to the class
+        attributes['save_many'] = save_many
+
         # Fetch a Single Row based on the attributes provided
         def fetch_row(self, conditional_items=None,
                       key_condition_expression=None,
                       filter_expression=None, attributes_to_fetch=[],
                       sort_key=True):
             if not key_condition_expression:
-                if sort_key:
-                    key_condition_expression = Key(
-                        PARTITION_KEY
-                    ).eq(
-                        self.__getattribute__(PARTITION_KEY)
-                    ) & Key(
-                        SORT_KEY
-                    ).eq(
-                        self.__getattribute__(SORT_KEY)
-                    )
-                else:
-                    key_condition_expression = Key(
-                        PARTITION_KEY
-                    ).eq(
-                        self.__getattribute__(PARTITION_KEY)
-                    )
+                key_condition_expression = db_adapter.key_condition(
+                    self.__getattribute__(PARTITION_KEY),
+                    self.__getattribute__(SORT_KEY) if sort_key else None,
+                    sort_key=sort_key
+                )
             if not conditional_items:
                 conditional_items = [
                     PARTITION_KEY, SORT_KEY
@@ -238,7 +416,7 @@ class Model(type):
                     PARTITION_KEY
                 ]
 
-            result = db_adapter.fetch_row(
+            result = read_adapter.fetch_row(
                 attributes_to_fetch=attributes_to_fetch,
                 conditional_items=conditional_items,
                 key_condition_expression=key_condition_expression,
@@ -247,14 +425,18 @@ class Model(type):
             )
 
             # Return the fetched row
-            return db_json.loads(result)
+            return loads(result)
 
         # Mapping function to the class
         attributes['fetch_row'] = fetch_row
 
         def fetch_all_rows(self, **kwargs):
-            response = db_adapter.fetch_all_rows(**kwargs)
-            return db_json.loads(response)
+            response = read_adapter.fetch_all_rows(**kwargs)
+            if shared_aggregates is not None:
+                response['Items'] = shared_aggregates.drop_aggregate_items(
+                    response.get('Items', [])
+                )
+            return loads(response)
 
         # Scan all the row from DB
         attributes['fetch_all_rows'] = fetch_all_rows
@@ -279,7 +461,7 @@ class Model(type):
             )
             if result:
                 self.populate_cols(**result)
-            return db_json.loads(result)
+            return loads(result)
 
         # Fetch the row and populate its cols -- leave keys
         attributes['fetch_and_populate_cols'] = fetch_and_populate_cols
@@ -300,8 +482,13 @@ class Model(type):
                         self.__getattribute__(PARTITION_KEY)
                     }
             # Returns the Delete Response
-            response = db_adapter.delete_row(item=key)
-            return db_json.loads(response)
+            response = db_adapter.delete_row(
+                key=key,
+                return_values='ALL_OLD' if write_aggregates else 'NONE'
+            )
+            if write_aggregates:
+                aggregates.apply_write(response.get('Attributes'), None)
+            return loads(response)
 
         # Mapping function to the class
         attributes['delete_row'] = delete_row
@@ -315,49 +502,168 @@ class Model(type):
                 }
             }
             # Returns the fetch Response
-            response = db_adapter.batch_get_item(
+            response = read_adapter.batch_get_item(
                 request_items=request_items,
                 return_consumed_capacity=return_consumed_capacity
             )
-            return db_json.loads(response)
+            return loads(response)
 
         # Mapping function to the class
         attributes['fetch_rows_on_keys'] = fetch_rows_on_keys
 
         # Function to get all the values based on partition key
         def query_on_partition_key(self, value, limit=None, select=None):
-            response = db_adapter.query_items(
-                {
-                    'KeyConditionExpression': Key(PARTITION_KEY).eq(value),
-                    'Limit': limit or sys.maxsize,
-                    'Select': select or 'ALL_ATTRIBUTES'
-                }
-            )
-            return db_json.loads(response)
+            query_obj = db_adapter.key_condition(value, sort_key=False)
+            query_obj.update({
+                'Limit': limit or sys.maxsize,
+                'Select': select or 'ALL_ATTRIBUTES'
+            })
+            response = read_adapter.query_items(query_obj)
+            if isinstance(response, list):
+                return decode_items(response)
+            return loads(response)
 
         # Mapping function to the class
         attributes['query_on_partition_key'] = query_on_partition_key
 
         # Function to query table with a complete query obj
         def query_table(self, query_obj):
-            response = db_adapter.query_items(query_obj)
-            return db_json.loads(response)
+            response = read_adapter.query_items(query_obj)
+            if isinstance(response, list):
+                return decode_items(response)
+            return loads(response)
 
         # Mapping function to the class
         attributes['query_table'] = query_table
 
+        # Function to page through a query, on the partition key of the
+        # instance if no query obj is provided
+        def paginate_query(self, query_obj=None, page_size=100, cursor=None,
+                           prefetch=1):
+            if query_obj is None:
+                query_obj = db_adapter.key_condition(
+                    self.__getattribute__(PARTITION_KEY), sort_key=False
+                )
+            query_obj = dict(query_obj, Limit=page_size)
+            return PagedResult(
+                lambda start_key: read_adapter.query_page(
+                    query_obj, exclusive_start_key=start_key
+                ),
+                cursor=cursor,
+                prefetch=prefetch,
+                decode=decode_items
+            )
+
+        # Mapping function to the class
+        attributes['paginate_query'] = paginate_query
+
+        # Function to page through a scan of the table
+        def paginate_scan(self, scan_obj=None, page_size=100, cursor=None,
+                          prefetch=1):
+            scan_obj = dict(scan_obj or {}, Limit=page_size)
+            return PagedResult(
+                lambda start_key: read_adapter.scan_page(
+                    scan_obj, exclusive_start_key=start_key
+                ),
+                cursor=cursor,
+                prefetch=prefetch,
+                decode=decode_items
+            )
+
+        # Mapping function to the class
+        attributes['paginate_scan'] = paginate_scan
+
         def update_row(self, update_values=None, delete_none=True):
             # Returns the Delete Response
             if delete_none:
-                obj = db_adapter.del_empty_key_values(self.to_dict())
+                obj = db_adapter.del_empty_key_values(
+                    validator.serialize(self.to_dict(), partial=True)
+                )
             else:
-                obj = self.to_dict()
-            response = db_adapter.update_row(input_values=obj)
-            return db_json.loads(response)
+                obj = validator.serialize(
+                    self.to_dict(), partial=True, drop_empty=False
+                )
+            response = db_adapter.update_row(
+                input_values=obj,
+                version_key=VERSION_KEY,
+                return_values='ALL_OLD' if write_aggregates else 'NONE'
+            )
+            if VERSION_KEY:
+                self.__setattr__(
+                    VERSION_KEY, (obj.get(VERSION_KEY) or 0) + 1
+                )
+            if write_aggregates:
+                old = response.get('Attributes')
+                aggregates.apply_write(old, dict(old or {}, **obj))
+            return loads(response)
 
         # Mapping function to the class
         attributes['update_row'] = update_row
 
+        # Function to build a consumer of the table stream
+        def stream_consumer(self, source=None, checkpoint_path=None,
+                            batch_size=100, max_workers=4):
+            return StreamConsumer(
+                type(self),
+                source or DDBStreamSource(db_adapter),
+                checkpoint=ShardCheckpoint(checkpoint_path),
+                batch_size=batch_size,
+                max_workers=max_workers,
+                ignore_keys=(
+                    shared_aggregates.is_aggregate_item
+                    if shared_aggregates is not None else None
+                )
+            )
+
+        # Mapping function to the class
+        attributes['stream_consumer'] = stream_consumer
+
+        # Function to read an aggregate value with a single GetItem
+        # group_value defaults to the group attribute of the instance
+        def fetch_aggregate(self, name, group_value=None):
+            if aggregates is None:
+                raise TypeError('Model defines no aggregates')
+            if group_value is None:
+                group_value = self.__getattribute__(
+                    AGGREGATES[name].group_by or PARTITION_KEY
+                )
+            return loads(aggregates.fetch(name, group_value))
+
+        # Mapping function to the class
+        attributes['fetch_aggregate'] = fetch_aggregate
+
+        # Function to maintain the change feed aggregates from a consumer
+        def maintain_aggregates(self, consumer):
+            if aggregates is None:
+                raise TypeError('Model defines no aggregates')
+            return aggregates.register(consumer)
+
+        # Mapping function to the class
+        attributes['maintain_aggregates'] = maintain_aggregates
+
+        # Function to apply again the on write aggregate updates which
+        # failed after their item write, returns the number still failing
+        def repair_aggregates(self):
+            if aggregates is None:
+                raise TypeError('Model defines no aggregates')
+            return aggregates.retry_failed()
+
+        # Mapping function to the class
+        attributes['repair_aggregates'] = repair_aggregates
+
+        # Time the generated methods when tracing is enabled, and name
+        # them after the class so that they pickle by reference
+        qualname = attributes.get('__qualname__', class_name)
+        for key in set(attributes) - user_attributes:
+            if not key.startswith('__'):
+                method = traced(
+                    '{}.{}'.format(class_name, key)
+                )(attributes[key])
+                method.__name__ = key
+                method.__qualname__ = '{}.{}'.format(qualname, key)
+                method.__module__ = attributes.get('__module__')
+                attributes[key] = method
+
         return super().__new__(
             model_attr,
             class_name,
@@ -0,0 +1,258 @@
+"""
+    Paginated Query and Scan Results
+"""
+
+# Imports
+import base64
+import json
+import queue
+import threading
+
+# AWS Imports
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+from .ddb import DDBError
+
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+# Types of the key attributes found in a LastEvaluatedKey
+KEY_TYPES = ('S', 'N', 'B')
+
+
+def encode_cursor(last_evaluated_key):
+    """Serializes a LastEvaluatedKey into an opaque url safe cursor
+
+    Args:
+        last_evaluated_key (dict): Key returned by query or scan
+
+    Returns:
+        str: Cursor, None when there is no next page
+    """
+
+    if not last_evaluated_key:
+        return None
+
+    key = dict()
+    for name, value in last_evaluated_key.items():
+        attribute = _serializer.serialize(value)
+        if 'B' in attribute:
+            attribute = {
+                'B': base64.b64encode(bytes(attribute['B'])).decode('ascii')
+            }
+        key[name] = attribute
+
+    return base64.urlsafe_b64encode(
+        json.dumps(key, separators=(',', ':')).encode('utf-8')
+    ).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Returns the ExclusiveStartKey encoded in a cursor"""
+
+    if not cursor:
+        return None
+
+    # Cursors come from the clients, anything but a dict of key
+    # attributes is rejected
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if not isinstance(key, dict) or not key:
+            raise ValueError(cursor)
+        for name, attribute in key.items():
+            if not isinstance(attribute, dict) or len(attribute) != 1:
+                raise ValueError(attribute)
+            (attribute_type, value), = attribute.items()
+            if attribute_type not in KEY_TYPES or \
+                    not isinstance(value, str):
+                raise ValueError(attribute)
+            if attribute_type == 'B':
+                attribute = {'B': base64.b64decode(value, validate=True)}
+            key[name] = _deserializer.deserialize(attribute)
+            if attribute_type == 'N' and not key[name].is_finite():
+                raise ValueError(attribute)
+    except (ValueError, TypeError, AttributeError, ArithmeticError):
+        raise DDBError('Invalid pagination cursor')
+    return key
+
+
+class ResultPage:
+    """
+        One page of a query or scan
+    """
+
+    def __init__(self, items, cursor=None, consumed_capacity=None,
+                 scanned_count=0, count=0):
+        """Initialize ResultPage variables
+
+        Args:
+            items (list): Items of the page
+            cursor (str): Cursor of the next page, None on the last page
+            consumed_capacity (dict): ConsumedCapacity of the request
+            scanned_count (int): Items evaluated before the filter
+            count (int): Items returned
+        """
+
+        self.items = items
+        self.cursor = cursor
+        self.consumed_capacity = consumed_capacity
+        self.scanned_count = scanned_count
+        self.count = count
+
+    @property
+    def has_more(self):
+        return self.cursor is not None
+
+    @classmethod
+    def from_response(cls, response, decode=None):
+        items = response.get('Items', [])
+        return cls(
+            items=decode(items) if decode else items,
+            cursor=encode_cursor(response.get('LastEvaluatedKey')),
+            consumed_capacity=response.get('ConsumedCapacity'),
+            scanned_count=response.get('ScannedCount', 0),
+            count=response.get('Count', 0)
+        )
+
+
+# Seconds the prefetch worker waits on a full queue before checking
+# whether the result was closed
+_PUT_TIMEOUT = 0.1
+
+
+def _put(pages, page, closed):
+    while not closed.is_set():
+        try:
+            pages.put(page, timeout=_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _produce(fetch_page, decode, start_key, pages, closed):
+    # Pages are chained through LastEvaluatedKey, so they are read in
+    # order and the bounded queue caps the pages held ahead. The worker
+    # holds no reference to the PagedResult, which stops it once
+    # garbage collected.
+    next_key = start_key
+    while not closed.is_set():
+        try:
+            page = ResultPage.from_response(fetch_page(next_key), decode)
+        except Exception as err:
+            _put(pages, err, closed)
+            return
+        if not _put(pages, page, closed) or page.cursor is None:
+            return
+        next_key = decode_cursor(page.cursor)
+
+
+class PagedResult:
+    """
+        Iterates the pages of a query or scan. The first page is read on
+        request; once a second page is requested up to `prefetch` next
+        pages are fetched on a background thread while the current one
+        is served. Pages are dropped once consumed, so besides the served
+        page only the queued pages and the one being read are held.
+    """
+
+    def __init__(self, fetch_page, cursor=None, prefetch=1, decode=None):
+        """Initialize PagedResult variables
+
+        Args:
+            fetch_page (callable): Called with the ExclusiveStartKey
+                (None for the first page), returns the raw response
+            cursor (str): Cursor to resume from
+            prefetch (int): Pages fetched ahead, 0 disables prefetching
+            decode (callable): Applied to the items of every page
+        """
+
+        self._closed = threading.Event()
+        self._queue = None
+        self._fetch_page = fetch_page
+        self._next_key = decode_cursor(cursor)
+        self._prefetch = prefetch
+        self._decode = decode
+        self._exhausted = False
+
+        # Totals of the pages served so far
+        self.pages_read = 0
+        self.scanned_count = 0
+        self.consumed_capacity_units = 0.0
+
+    def _load(self):
+        page = ResultPage.from_response(
+            self._fetch_page(self._next_key), self._decode
+        )
+        self._next_key = decode_cursor(page.cursor)
+        return page
+
+    def _start_prefetch(self):
+        self._queue = queue.Queue(maxsize=self._prefetch)
+        threading.Thread(
+            target=_produce,
+            args=(
+                self._fetch_page, self._decode, self._next_key,
+                self._queue, self._closed
+            ),
+            daemon=True
+        ).start()
+
+    def next_page(self):
+        """Returns the next page, None once all pages were read"""
+
+        if self._exhausted or self._closed.is_set():
+            return None
+
+        # Callers serving a single page never start the worker
+        if not self._prefetch or not self.pages_read:
+            page = self._load()
+        else:
+            if self._queue is None:
+                self._start_prefetch()
+            page = self._queue.get()
+            if isinstance(page, Exception):
+                self._exhausted = True
+                raise page
+
+        if page.cursor is None:
+            self._exhausted = True
+
+        self.pages_read += 1
+        self.scanned_count += page.scanned_count
+        if page.consumed_capacity:
+            self.consumed_capacity_units += page.consumed_capacity.get(
+                'CapacityUnits', 0
+            )
+        return page
+
+    def __iter__(self):
+        while True:
+            page = self.next_page()
+            if page is None:
+                return
+            yield page
+
+    def items(self):
+        """Iterates the items of all the pages"""
+
+        for page in self:
+            yield from page.items
+
+    def close(self):
+        """Stops prefetching and drops the pages not served yet"""
+
+        self._closed.set()
+        if self._queue is not None:
+            while not self._queue.empty():
+                self._queue.get_nowait()
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
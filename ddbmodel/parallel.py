@@ -0,0 +1,121 @@
+"""
+    Process Pool Helpers for Bulk Reads
+
+    Model classes are sent to the workers by reference, so they must be
+    defined at module level. Every worker builds its own boto3 clients
+    on first use.
+"""
+
+# Imports
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+# BatchGetItem accepts at most 100 keys per request
+MAX_BATCH_KEYS = 100
+
+
+def _decode_items(model_class, items, decode, as_models):
+    if as_models:
+        instances = []
+        for item in items:
+            instance = model_class()
+            instance.populate(**item)
+            instances.append(instance)
+        items = instances
+    if decode is not None:
+        items = [decode(item) for item in items]
+    return items
+
+
+def _fetch_keys(model_class, keys, decode, as_models):
+    responses = model_class().fetch_rows_on_keys(keys)
+    items = [
+        item
+        for response in responses
+        for table_items in response.values()
+        for item in table_items
+    ]
+    return _decode_items(model_class, items, decode, as_models)
+
+
+def _scan_segment(model_class, segment, total_segments, scan_obj,
+                  page_size, decode, as_models):
+    scan_obj = dict(
+        scan_obj or {}, Segment=segment, TotalSegments=total_segments
+    )
+    items = list(model_class().paginate_scan(
+        scan_obj, page_size=page_size, prefetch=0
+    ).items())
+    return _decode_items(model_class, items, decode, as_models)
+
+
+def fetch_keys_parallel(model_class, keys, processes=None,
+                        chunk_size=MAX_BATCH_KEYS, decode=None,
+                        as_models=False):
+    """Fetches a key set with BatchGetItem spread over worker processes
+
+    Args:
+        model_class (Model): Module level model class
+        keys (list): Key dicts of the items
+        processes (int): Worker processes, os.cpu_count() if None
+        chunk_size (int): Keys per BatchGetItem request
+        decode (callable): Picklable function applied to every item in
+            the worker
+        as_models (bool): Return populated model instances
+
+    Returns:
+        list: Items in the order of the chunks
+    """
+
+    chunk_size = min(chunk_size, MAX_BATCH_KEYS)
+    chunks = [
+        keys[index:index + chunk_size]
+        for index in range(0, len(keys), chunk_size)
+    ]
+    if not chunks:
+        return []
+
+    with ProcessPoolExecutor(
+        max_workers=min(processes or os.cpu_count(), len(chunks))
+    ) as executor:
+        futures = [
+            executor.submit(
+                _fetch_keys, model_class, chunk, decode, as_models
+            ) for chunk in chunks
+        ]
+        return [item for future in futures for item in future.result()]
+
+
+def parallel_scan(model_class, total_segments=None, processes=None,
+                  scan_obj=None, page_size=1000, decode=None,
+                  as_models=False):
+    """Scans the table in segments spread over worker processes
+
+    Args:
+        model_class (Model): Module level model class
+        total_segments (int): Scan segments, processes if None
+        processes (int): Worker processes, os.cpu_count() if None
+        scan_obj (dict): Extra scan params, e.g. a FilterExpression
+        page_size (int): Items per scan request
+        decode (callable): Picklable function applied to every item in
+            the worker
+        as_models (bool): Return populated model instances
+
+    Returns:
+        list: Items in the order of the segments
+    """
+
+    processes = processes or os.cpu_count()
+    total_segments = total_segments or processes
+
+    with ProcessPoolExecutor(
+        max_workers=min(processes, total_segments)
+    ) as executor:
+        futures = [
+            executor.submit(
+                _scan_segment, model_class, segment, total_segments,
+                scan_obj, page_size, decode, as_models
+            ) for segment in range(total_segments)
+        ]
+        return [item for future in futures for item in future.result()]
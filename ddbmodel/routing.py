@@ -0,0 +1,262 @@
+"""
+    Read Routing Across Table Replicas
+"""
+
+# Imports
+import copy
+import functools
+import os
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .ddb import DDBApi, DDBError
+
+
+# Routers of the process, their threads do not survive a fork
+_ROUTERS = weakref.WeakSet()
+
+
+def _reset_routers_after_fork():
+    for router in list(_ROUTERS):
+        router.reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_routers_after_fork)
+
+
+class LatencyTracker:
+    """
+        Moving latency estimate of a replica
+    """
+
+    def __init__(self, alpha=0.2, window=256):
+        """Initialize LatencyTracker variables
+
+        Args:
+            alpha (float): Weight of the latest sample in the moving average
+            window (int): Number of samples kept for the percentiles
+        """
+
+        self._alpha = alpha
+        self._samples = deque(maxlen=window)
+        self._estimate = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            if self._estimate is None:
+                self._estimate = seconds
+            else:
+                self._estimate += self._alpha * (seconds - self._estimate)
+
+    @property
+    def estimate(self):
+        return self._estimate
+
+    def percentile(self, percentile):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(
+            len(samples) - 1, int(len(samples) * percentile / 100.0)
+        )
+        return samples[index]
+
+
+class ReplicaRouter:
+    """
+        Sends reads to the replica with the lowest moving latency, a
+        small fraction of them probes the other replicas.
+        With hedging enabled a second request goes to the next replica
+        once the first one exceeds the latency percentile; the slower
+        request is cancelled if still queued, otherwise its result is
+        dropped. Only single request reads are hedged, a running request
+        can not be stopped between pages. Writes are not routed and stay
+        on the home adapter.
+    """
+
+    READ_METHODS = (
+        'fetch_row', 'fetch_all_rows', 'query_db', 'get_item',
+        'get_item_by_secondary_index', 'batch_get_item', 'query_items',
+        'query_page', 'scan_page'
+    )
+
+    # Reads sending a single request, query_items pages through the
+    # whole query and batch_get_item loops over the unprocessed keys
+    HEDGED_METHODS = (
+        'fetch_row', 'fetch_all_rows', 'query_db', 'get_item',
+        'get_item_by_secondary_index', 'query_page', 'scan_page'
+    )
+
+    def __init__(self, adapters, hedge_percentile=None, max_workers=8,
+                 probe_rate=0.05):
+        """Initialize ReplicaRouter variables
+
+        Args:
+            adapters (list): DDBApi per replica, the home region first
+            hedge_percentile (float): Latency percentile after which a
+                hedged request is sent, None disables hedging
+            max_workers (int): Threads used for hedged requests
+            probe_rate (float): Fraction of the reads sent to another
+                replica to keep its latency estimate current
+        """
+
+        if not adapters:
+            raise DDBError('At least one replica is required')
+
+        self._adapters = list(adapters)
+        self._trackers = [LatencyTracker() for _ in self._adapters]
+        # Hedge thresholds per replica and method, a scan page and a
+        # single get do not share a latency distribution
+        self._method_trackers = dict()
+        self._hedge_percentile = hedge_percentile
+        self._max_workers = max_workers
+        self._probe_rate = probe_rate
+        self._executor = None
+        self._lock = threading.Lock()
+        _ROUTERS.add(self)
+
+    def reset_after_fork(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        for tracker in self._trackers:
+            tracker._lock = threading.Lock()
+        for tracker in self._method_trackers.values():
+            tracker._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings, home_adapter):
+        """Builds the router from DDB_REPLICA_REGIONS of the settings
+
+        Args:
+            settings (DB_SettingsHelper): Settings of the home table
+            home_adapter (DDBApi): Adapter of the home region
+        """
+
+        adapters = [home_adapter]
+        for region_name in settings.DDB_REPLICA_REGIONS:
+            if region_name == settings.AWSRegion:
+                continue
+            adapter = DDBApi(settings, region_name=region_name)
+            adapter.partition_key = home_adapter.partition_key
+            adapter.sort_key = home_adapter.sort_key
+            adapters.append(adapter)
+
+        return cls(
+            adapters,
+            hedge_percentile=getattr(settings, 'DDB_HEDGE_PERCENTILE', None)
+        )
+
+    @property
+    def home(self):
+        return self._adapters[0]
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._max_workers
+                )
+            return self._executor
+
+    def _ranked(self):
+        # Replicas without samples rank first so every one gets measured
+        ranked = sorted(
+            range(len(self._adapters)),
+            key=lambda index: self._trackers[index].estimate or 0.0
+        )
+        # An estimate only moves when its replica is called, so a few
+        # reads probe the others; with hedging the best one backs them up
+        if len(ranked) > 1 and random.random() < self._probe_rate:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked
+
+    def _method_tracker(self, index, method_name):
+        tracker = self._method_trackers.get((index, method_name))
+        if tracker is None:
+            with self._lock:
+                tracker = self._method_trackers.setdefault(
+                    (index, method_name), LatencyTracker()
+                )
+        return tracker
+
+    def _timed_call(self, index, method_name, args, kwargs):
+        start = time.perf_counter()
+        try:
+            return getattr(self._adapters[index], method_name)(
+                *args, **kwargs
+            )
+        finally:
+            elapsed = time.perf_counter() - start
+            self._trackers[index].record(elapsed)
+            self._method_tracker(index, method_name).record(elapsed)
+
+    @staticmethod
+    def _copy_arguments(args, kwargs):
+        return (
+            tuple(
+                copy.deepcopy(arg) if isinstance(arg, (dict, list)) else arg
+                for arg in args
+            ),
+            {
+                name: copy.deepcopy(value)
+                if isinstance(value, (dict, list)) else value
+                for name, value in kwargs.items()
+            }
+        )
+
+    def _hedged_call(self, primary, secondary, method_name, args, kwargs):
+        threshold = self._method_tracker(primary, method_name).percentile(
+            self._hedge_percentile
+        )
+        if threshold is None:
+            return self._timed_call(primary, method_name, args, kwargs)
+
+        # Both attempts get their own copy of the mutable arguments
+        executor = self._get_executor()
+        first = executor.submit(
+            self._timed_call, primary, method_name,
+            *self._copy_arguments(args, kwargs)
+        )
+        done, _ = wait([first], timeout=threshold)
+        if done:
+            return first.result()
+
+        second = executor.submit(
+            self._timed_call, secondary, method_name,
+            *self._copy_arguments(args, kwargs)
+        )
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # Prefer a successful response when both completed together
+            for future in sorted(
+                done, key=lambda future: future.exception() is not None
+            ):
+                if future.exception() is None or not pending:
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result()
+
+    def call(self, method_name, *args, **kwargs):
+        ranked = self._ranked()
+        if self._hedge_percentile is None or len(ranked) < 2 \
+                or method_name not in self.HEDGED_METHODS:
+            return self._timed_call(ranked[0], method_name, args, kwargs)
+        return self._hedged_call(
+            ranked[0], ranked[1], method_name, args, kwargs
+        )
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self.READ_METHODS:
+            return functools.partial(self.call, name)
+        return getattr(self.home, name)
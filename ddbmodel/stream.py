@@ -0,0 +1,445 @@
+"""
+    DynamoDB Streams Change Feed
+"""
+
+# Imports
+import abc
+import json
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# AWS Imports
+import boto3
+import botocore
+from dynamodb_json import json_util as db_json
+
+from .ddb import DDBError
+
+
+INSERT = 'INSERT'
+MODIFY = 'MODIFY'
+REMOVE = 'REMOVE'
+
+EVENT_NAMES = (INSERT, MODIFY, REMOVE)
+
+
+# Decoded stream record handed over to the registered handlers
+StreamEvent = namedtuple('StreamEvent', [
+    'event_name', 'shard_id', 'sequence_number', 'keys', 'new', 'old',
+    'record'
+])
+
+
+class StreamSource(abc.ABC):
+    """
+        Abstract Class for the source of the stream records.
+        Records follow the DynamoDB Streams `GetRecords` format.
+    """
+
+    @abc.abstractmethod
+    def list_shards(self):
+        """Returns the shards of the stream
+
+        Returns:
+            list: dicts with `ShardId` and optional `ParentShardId`
+        """
+        pass
+
+    @abc.abstractmethod
+    def read_shard(self, shard_id, after_sequence_number=None, limit=100):
+        """Reads the next records of a shard
+
+        Args:
+            shard_id (str): Shard to read
+            after_sequence_number (str):
+                Last processed sequence number, None to read from the start
+            limit (int): Maximum number of records to return
+
+        Returns:
+            tuple: (list of records, True if the shard is closed and
+            fully read)
+        """
+        pass
+
+
+class DDBStreamSource(StreamSource):
+    """
+        Stream source reading the table stream through the
+        `dynamodbstreams` client.
+    """
+
+    def __init__(self, db_adapter):
+        """Initialize DDBStreamSource variables
+
+        Args:
+            db_adapter (DDBApi): Adapter of the table owning the stream
+        """
+
+        self._settings = db_adapter._settings
+        self._stream_arn = db_adapter.get_stream_arn()
+        self._client = boto3.client(
+            service_name="dynamodbstreams",
+            region_name=self._settings.AWSRegion
+        )
+        self._iterators = dict()
+        self._lock = threading.Lock()
+
+    def list_shards(self):
+        shards = []
+        params = {'StreamArn': self._stream_arn}
+        while True:
+            description = self._client.describe_stream(
+                **params
+            )['StreamDescription']
+            shards.extend(
+                {
+                    'ShardId': shard['ShardId'],
+                    'ParentShardId': shard.get('ParentShardId')
+                } for shard in description.get('Shards', [])
+            )
+            last_shard_id = description.get('LastEvaluatedShardId')
+            if not last_shard_id:
+                break
+            params['ExclusiveStartShardId'] = last_shard_id
+        return shards
+
+    def _get_shard_iterator(self, shard_id, after_sequence_number):
+        params = {
+            'StreamArn': self._stream_arn,
+            'ShardId': shard_id,
+            'ShardIteratorType': 'TRIM_HORIZON'
+        }
+        if after_sequence_number is not None:
+            params['ShardIteratorType'] = 'AFTER_SEQUENCE_NUMBER'
+            params['SequenceNumber'] = after_sequence_number
+        return self._client.get_shard_iterator(**params)['ShardIterator']
+
+    def read_shard(self, shard_id, after_sequence_number=None, limit=100):
+        # The cached iterator continues after the last record returned,
+        # it is only reused when that record was checkpointed; after a
+        # failed batch the shard is read again from the checkpoint
+        with self._lock:
+            iterator, position = self._iterators.get(shard_id, (None, None))
+        if iterator is None or position != after_sequence_number:
+            iterator = self._get_shard_iterator(
+                shard_id, after_sequence_number
+            )
+
+        try:
+            response = self._client.get_records(
+                ShardIterator=iterator, Limit=limit
+            )
+        except botocore.exceptions.ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code == "ExpiredIteratorException":
+                # Iterators are valid for 15 minutes, restart from the
+                # last checkpoint
+                with self._lock:
+                    self._iterators.pop(shard_id, None)
+                return [], False
+            raise DDBError(
+                'Stream read failed. Error Code: {0} Error: {1}'.format(
+                    e.response["Error"]["Code"],
+                    e.response["Error"]["Message"])
+            )
+
+        records = response.get('Records', [])
+        next_iterator = response.get('NextShardIterator')
+        with self._lock:
+            if next_iterator:
+                self._iterators[shard_id] = (
+                    next_iterator,
+                    records[-1]['dynamodb']['SequenceNumber']
+                    if records else after_sequence_number
+                )
+            else:
+                self._iterators.pop(shard_id, None)
+
+        return records, next_iterator is None
+
+
+class FakeStreamSource(StreamSource):
+    """
+        In-memory stream source to exercise consumers locally
+    """
+
+    def __init__(self):
+        self._shards = dict()
+        self._parents = dict()
+        self._closed = set()
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def add_shard(self, shard_id, parent_shard_id=None):
+        with self._lock:
+            self._shards.setdefault(shard_id, [])
+            self._parents[shard_id] = parent_shard_id
+
+    def close_shard(self, shard_id):
+        with self._lock:
+            self._closed.add(shard_id)
+
+    def put_record(self, shard_id, event_name, keys,
+                   new_image=None, old_image=None):
+        """Appends a record to a shard
+
+        Args:
+            shard_id (str): Shard receiving the record
+            event_name (str): INSERT, MODIFY or REMOVE
+            keys (dict): Key attributes of the item
+            new_image (dict): Item after the change
+            old_image (dict): Item before the change
+        """
+
+        if event_name not in EVENT_NAMES:
+            raise DDBError('Unknown stream event {}'.format(event_name))
+
+        with self._lock:
+            self._shards.setdefault(shard_id, [])
+            self._parents.setdefault(shard_id, None)
+            self._sequence += 1
+            data = {
+                'Keys': db_json.dumps(keys, as_dict=True),
+                'SequenceNumber': '{:021d}'.format(self._sequence)
+            }
+            if new_image is not None:
+                data['NewImage'] = db_json.dumps(new_image, as_dict=True)
+            if old_image is not None:
+                data['OldImage'] = db_json.dumps(old_image, as_dict=True)
+            self._shards[shard_id].append({
+                'eventID': str(self._sequence),
+                'eventName': event_name,
+                'eventSource': 'aws:dynamodb',
+                'dynamodb': data
+            })
+
+    def list_shards(self):
+        with self._lock:
+            return [
+                {'ShardId': shard_id, 'ParentShardId': parent_shard_id}
+                for shard_id, parent_shard_id in self._parents.items()
+            ]
+
+    def read_shard(self, shard_id, after_sequence_number=None, limit=100):
+        with self._lock:
+            records = [
+                record for record in self._shards.get(shard_id, [])
+                if after_sequence_number is None
+                or record['dynamodb']['SequenceNumber']
+                > after_sequence_number
+            ]
+            closed = shard_id in self._closed
+        return records[:limit], closed and len(records) <= limit
+
+
+class ShardCheckpoint:
+    """
+        Keeps the last processed sequence number of every shard,
+        optionally persisted to a local json file.
+    """
+
+    def __init__(self, path=None):
+        """Initialize ShardCheckpoint variables
+
+        Args:
+            path (str): File to persist the checkpoints, None keeps them
+                in memory only
+        """
+
+        self._path = path
+        self._lock = threading.Lock()
+        self._shards = dict()
+        if path and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self._shards = json.load(checkpoint_file)
+
+    def get(self, shard_id):
+        with self._lock:
+            return self._shards.get(shard_id, {}).get('sequence_number')
+
+    def is_closed(self, shard_id):
+        with self._lock:
+            return self._shards.get(shard_id, {}).get('closed', False)
+
+    def update(self, shard_id, sequence_number=None, closed=False):
+        with self._lock:
+            shard = self._shards.setdefault(shard_id, {})
+            if sequence_number is not None:
+                shard['sequence_number'] = sequence_number
+            shard['closed'] = closed
+            self._flush()
+
+    def _flush(self):
+        if not self._path:
+            return
+        # Write and rename so a crash never leaves a partial checkpoint
+        tmp_path = '{}.tmp'.format(self._path)
+        with open(tmp_path, 'w') as checkpoint_file:
+            json.dump(self._shards, checkpoint_file)
+        os.replace(tmp_path, self._path)
+
+
+class StreamConsumer:
+    """
+        Reads the stream shards in parallel, decodes the records into
+        model instances and dispatches them in batches to the handlers
+        registered for INSERT, MODIFY and REMOVE events. Every batch is
+        a run of consecutive events of one type, in shard order.
+    """
+
+    def __init__(self, model_class, source, checkpoint=None,
+                 batch_size=100, max_workers=4, ignore_keys=None):
+        """Initialize StreamConsumer variables
+
+        Args:
+            model_class (Model): Model class the records are decoded into
+            source (StreamSource): Source of the stream records
+            checkpoint (ShardCheckpoint): Shard positions, in memory if None
+            batch_size (int): Maximum records read per shard and batch
+            max_workers (int): Number of shards read in parallel
+            ignore_keys (callable): Called with the keys of every record,
+                records it returns True for are not dispatched
+        """
+
+        self._model_class = model_class
+        self._source = source
+        self._checkpoint = checkpoint or ShardCheckpoint()
+        self._batch_size = batch_size
+        self._max_workers = max_workers
+        self._ignore_keys = ignore_keys
+        self._handlers = {event_name: [] for event_name in EVENT_NAMES}
+        self._dispatch_lock = threading.Lock()
+
+    def on(self, event_name, handler):
+        """Registers a handler for an event
+
+        Args:
+            event_name (str): INSERT, MODIFY or REMOVE
+            handler (callable): Called with a run of consecutive
+                StreamEvent of the event type, in shard order. Handlers
+                are never called concurrently, even across shards.
+        """
+
+        if event_name not in self._handlers:
+            raise DDBError('Unknown stream event {}'.format(event_name))
+        self._handlers[event_name].append(handler)
+        return handler
+
+    def on_insert(self, handler):
+        return self.on(INSERT, handler)
+
+    def on_modify(self, handler):
+        return self.on(MODIFY, handler)
+
+    def on_remove(self, handler):
+        return self.on(REMOVE, handler)
+
+    def _decode_image(self, image):
+        if image is None:
+            return None
+        instance = self._model_class()
+        instance.populate(**db_json.loads(image))
+        return instance
+
+    def decode(self, shard_id, record):
+        data = record['dynamodb']
+        return StreamEvent(
+            event_name=record['eventName'],
+            shard_id=shard_id,
+            sequence_number=data['SequenceNumber'],
+            keys=db_json.loads(data.get('Keys', {})),
+            new=self._decode_image(data.get('NewImage')),
+            old=self._decode_image(data.get('OldImage')),
+            record=record
+        )
+
+    def _dispatch(self, events):
+        # Runs of consecutive events of the same type are dispatched in
+        # record order, so a REMOVE followed by an INSERT of the same item
+        # reaches the handlers in that order
+        batch = []
+        for event in events:
+            if batch and event.event_name != batch[0].event_name:
+                self._dispatch_batch(batch)
+                batch = []
+            batch.append(event)
+        if batch:
+            self._dispatch_batch(batch)
+
+    def _dispatch_batch(self, batch):
+        # Shards are read in parallel, handlers are called one at a time
+        with self._dispatch_lock:
+            for handler in self._handlers[batch[0].event_name]:
+                handler(batch)
+
+    def _process_shard(self, shard_id):
+        records, closed = self._source.read_shard(
+            shard_id,
+            after_sequence_number=self._checkpoint.get(shard_id),
+            limit=self._batch_size
+        )
+        events = [self.decode(shard_id, record) for record in records]
+        if self._ignore_keys is not None:
+            events = [
+                event for event in events if not self._ignore_keys(event.keys)
+            ]
+        if events:
+            self._dispatch(events)
+
+        # Checkpoint only once the handlers accepted the batch
+        self._checkpoint.update(
+            shard_id,
+            sequence_number=(
+                records[-1]['dynamodb']['SequenceNumber'] if records else None
+            ),
+            closed=closed
+        )
+        return len(records)
+
+    def _readable_shards(self):
+        shards = self._source.list_shards()
+        shard_ids = {shard['ShardId'] for shard in shards}
+        readable = []
+        for shard in shards:
+            shard_id = shard['ShardId']
+            parent_shard_id = shard.get('ParentShardId')
+            if self._checkpoint.is_closed(shard_id):
+                continue
+            # Child shards are read once their parent is exhausted to
+            # keep the per item ordering
+            if parent_shard_id in shard_ids and not \
+                    self._checkpoint.is_closed(parent_shard_id):
+                continue
+            readable.append(shard_id)
+        return readable
+
+    def poll(self):
+        """Reads one batch from every readable shard
+
+        Returns:
+            int: Number of records read, ignored ones included
+        """
+
+        shard_ids = self._readable_shards()
+        if not shard_ids:
+            return 0
+
+        with ThreadPoolExecutor(
+            max_workers=min(self._max_workers, len(shard_ids))
+        ) as executor:
+            return sum(executor.map(self._process_shard, shard_ids))
+
+    def run(self, stop_event=None, poll_interval=1.0):
+        """Polls the stream until stop_event is set
+
+        Args:
+            stop_event (threading.Event): Stops the consumer once set
+            poll_interval (float): Seconds to wait when no record was read
+        """
+
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            if not self.poll():
+                stop_event.wait(poll_interval)
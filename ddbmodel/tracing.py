@@ -0,0 +1,311 @@
+"""
+    Tracing Spans for Model and DynamoDB Operations
+
+    Tracing is disabled by default, traced functions then only check a
+    flag before calling through.
+"""
+
+# Imports
+import functools
+import itertools
+import logging
+import random
+import threading
+import time
+
+
+class Span:
+    """
+        Timed operation, nested under the span active when it started
+    """
+
+    __slots__ = (
+        'name', 'trace_id', 'span_id', 'parent_id', 'start_time',
+        'duration', 'attributes', 'error', '_start'
+    )
+
+    def __init__(self, name, trace_id, span_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.error = None
+        self.duration = None
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_time': self.start_time,
+            'duration': self.duration,
+            'attributes': self.attributes,
+            'error': self.error
+        }
+
+
+class InMemoryExporter:
+    """
+        Keeps the finished spans, mostly for tests and profiling sessions
+    """
+
+    def __init__(self, max_spans=10000):
+        self._lock = threading.Lock()
+        self._max_spans = max_spans
+        self.spans = []
+
+    def export(self, span):
+        with self._lock:
+            if len(self.spans) < self._max_spans:
+                self.spans.append(span)
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+
+class LoggingExporter:
+    """
+        Logs every finished span
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self._logger = logger or logging.getLogger('ddbmodel.tracing')
+        self._level = level
+
+    def export(self, span):
+        self._logger.log(
+            self._level, '%s took %.3fms trace=%s span=%s parent=%s',
+            span.name, span.duration * 1000, span.trace_id, span.span_id,
+            span.parent_id
+        )
+
+
+class CallbackExporter:
+    """
+        Hands every finished span to a callback, e.g. to forward them
+        to OpenTelemetry
+    """
+
+    def __init__(self, callback):
+        self._callback = callback
+
+    def export(self, span):
+        self._callback(span)
+
+
+class _NoopSpan:
+    """
+        Context returned for unsampled traces
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+# Marks the thread as inside an unsampled trace
+_UNSAMPLED = object()
+
+
+class _ActiveSpan:
+
+    __slots__ = ('_tracer', '_span')
+
+    def __init__(self, tracer, span):
+        self._tracer = tracer
+        self._span = span
+
+    def __enter__(self):
+        self._tracer._local.stack.append(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stack = self._tracer._local.stack
+        if self._span not in stack:
+            return False
+        # Spans left open by a failed call are dropped with it
+        while stack.pop() is not self._span:
+            pass
+
+        self._span.finish()
+        if exc_value is not None:
+            self._span.error = repr(exc_value)
+        self._tracer._export(self._span)
+        return False
+
+
+class _UnsampledTrace:
+
+    __slots__ = ('_tracer',)
+
+    def __init__(self, tracer):
+        self._tracer = tracer
+
+    def __enter__(self):
+        self._tracer._local.stack.append(_UNSAMPLED)
+        return None
+
+    def __exit__(self, *args):
+        self._tracer._local.stack.pop()
+        return False
+
+
+class Tracer:
+    """
+        Creates the spans and sends them to the exporters. The sampling
+        decision is taken once per root span and followed by its children.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.exporters = []
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+
+    def configure(self, enabled=True, sample_rate=1.0, exporters=None):
+        """Configures the tracer
+
+        Args:
+            enabled (bool): Turns tracing on or off
+            sample_rate (float): Fraction of root spans traced
+            exporters (list): Objects with an export(span) method
+        """
+
+        self.sample_rate = sample_rate
+        if exporters is not None:
+            self.exporters = list(exporters)
+        self.enabled = enabled
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current_span(self):
+        stack = self._stack()
+        if not stack or stack[-1] is _UNSAMPLED:
+            return None
+        return stack[-1]
+
+    def span(self, name, **attributes):
+        """Returns a context manager timing the block as a span"""
+
+        if not self.enabled:
+            return _NOOP_SPAN
+
+        stack = self._stack()
+        if stack:
+            parent = stack[-1]
+            if parent is _UNSAMPLED:
+                return _NOOP_SPAN
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+                return _UnsampledTrace(self)
+            trace_id, parent_id = next(self._ids), None
+
+        return _ActiveSpan(self, Span(
+            name, trace_id, next(self._ids), parent_id, attributes
+        ))
+
+    def start_span(self, name, **attributes):
+        """Opens a span closed later by end_span, for event callbacks"""
+
+        context = self.span(name, **attributes)
+        context.__enter__()
+        return context
+
+    def end_span(self, context):
+        context.__exit__(None, None, None)
+
+    def _export(self, span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception:
+                logging.getLogger('ddbmodel.tracing').exception(
+                    'Span exporter failed'
+                )
+
+
+# Tracer used by the models and DDBApi
+tracer = Tracer()
+
+
+def traced(name):
+    """Decorator timing every call of the function as a span
+
+    Args:
+        name (str): Name of the span
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _open(stage):
+    def handler(**kwargs):
+        if not tracer.enabled:
+            return
+        _close()
+        tracer._local.boto_span = tracer.start_span(stage)
+    return handler
+
+
+def _close(**kwargs):
+    context = getattr(tracer._local, 'boto_span', None)
+    if context is not None:
+        tracer._local.boto_span = None
+        tracer.end_span(context)
+
+
+def instrument_client(client):
+    """Splits the boto3 calls of a client into serialize, network and
+    deserialize spans
+
+    Args:
+        client: boto3 dynamodb client
+    """
+
+    events = client.meta.events
+    events.register_first(
+        'provide-client-params.dynamodb', _open('boto3.serialize'),
+        unique_id='ddbmodel-trace-serialize'
+    )
+    events.register_last(
+        'before-send.dynamodb', _open('boto3.network'),
+        unique_id='ddbmodel-trace-network'
+    )
+    events.register_first(
+        'before-parse.dynamodb', _open('boto3.deserialize'),
+        unique_id='ddbmodel-trace-deserialize'
+    )
+    events.register_last(
+        'after-call.dynamodb', _close,
+        unique_id='ddbmodel-trace-close'
+    )
+    events.register_last(
+        'after-call-error.dynamodb', _close,
+        unique_id='ddbmodel-trace-close-error'
+    )
@@ -0,0 +1,268 @@
+"""
+    Model Validation and Serialization
+
+    The checks of a model are compiled once by the metaclass and run on
+    the write path before anything is sent to DynamoDB.
+"""
+
+# Imports
+import math
+from decimal import Decimal
+
+# AWS Imports
+from boto3.dynamodb.types import Binary
+
+from .ddb import DDBError
+
+
+# DynamoDB rejects items above 400 KB
+MAX_ITEM_SIZE = 400 * 1024
+
+# Types a mismatching value is converted to instead of rejected, and the
+# values accepted for the conversion
+COERCIBLE_TYPES = (str, int, float, Decimal)
+COERCIBLE_VALUES = (str, int, float, Decimal)
+
+# Values stored as they are for number columns, all serialized as Decimal
+NUMBER_VALUES = {
+    float: (float, int, Decimal),
+    Decimal: (Decimal, int, float),
+}
+
+
+class ValidationError(DDBError):
+    """
+        Exception Class for items failing the model validation.
+        errors maps the attribute name to the problem found.
+    """
+
+    def __init__(self, errors):
+        super().__init__('Validation failed: {}'.format(
+            ', '.join(
+                '{}: {}'.format(name, error) for name, error in errors.items()
+            )
+        ))
+        self.errors = errors
+
+
+def _is_finite(value):
+    if isinstance(value, float):
+        return math.isfinite(value)
+    if isinstance(value, Decimal):
+        return value.is_finite()
+    return True
+
+
+def _to_dynamodb(value):
+    # boto3 only accepts finite Decimal numbers
+    value_type = type(value)
+    if value_type is str or value_type is int:
+        return value
+    if not _is_finite(value):
+        raise TypeError('non finite number {}'.format(value))
+    if value_type is float:
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {key: _to_dynamodb(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [_to_dynamodb(val) for val in value]
+    if isinstance(value, (set, frozenset)):
+        return type(value)(_to_dynamodb(val) for val in value)
+    return value
+
+
+def _number_size(value):
+    digits = len(str(abs(value)).replace('.', '').strip('0')) or 1
+    return min(21, (digits + 1) // 2 + 1)
+
+
+def _str_size(value):
+    # Only non ascii characters take more than one byte
+    return len(value) if value.isascii() else len(value.encode('utf-8'))
+
+
+def _map_size(value):
+    return 3 + sum(
+        _str_size(key) + attribute_size(val) + 1
+        for key, val in value.items()
+    )
+
+
+def _list_size(value):
+    return 3 + sum(attribute_size(val) + 1 for val in value)
+
+
+def _set_size(value):
+    return sum(attribute_size(val) for val in value)
+
+
+# Size estimation per exact type, subclasses go through attribute_size
+_SIZERS = {
+    str: _str_size,
+    int: _number_size,
+    float: _number_size,
+    Decimal: _number_size,
+    bool: lambda value: 1,
+    type(None): lambda value: 1,
+    bytes: len,
+    bytearray: len,
+    dict: _map_size,
+    list: _list_size,
+    tuple: _list_size,
+    set: _set_size,
+    frozenset: _set_size,
+}
+
+
+def attribute_size(value):
+    """Estimates the stored size of a value in bytes"""
+
+    sizer = _SIZERS.get(type(value))
+    if sizer is not None:
+        return sizer(value)
+    if isinstance(value, Binary):
+        return len(value.value)
+    for value_type, sizer in _SIZERS.items():
+        if isinstance(value, value_type):
+            return sizer(value)
+    return _str_size(str(value))
+
+
+def item_size(item):
+    """Estimates the stored size of an item in bytes"""
+
+    return sum(
+        _str_size(name) + attribute_size(value)
+        for name, value in item.items()
+    )
+
+
+class ModelValidator:
+    """
+        Type checks, coercion, required attributes and size estimation
+        of the items of a model
+    """
+
+    def __init__(self, columns, required=(), max_item_size=MAX_ITEM_SIZE):
+        """Initialize ModelValidator variables
+
+        Args:
+            columns (dict): Declared type per attribute, None if untyped
+            required (iterable): Attributes which must have a value
+            max_item_size (int): Largest item size accepted in bytes
+        """
+
+        self._required = tuple(required)
+        self._max_item_size = max_item_size
+        self._checks = {
+            name: self._compile(column_type)
+            for name, column_type in columns.items()
+            if column_type is not None
+        }
+
+    @staticmethod
+    def _compile(column_type):
+        coercible = column_type in COERCIBLE_TYPES
+        accepted = NUMBER_VALUES.get(column_type, column_type)
+        # bool is an int subclass, it would be stored as a BOOL
+        accepts_bool = column_type is bool
+
+        def check(value):
+            if isinstance(value, accepted) and (
+                accepts_bool or not isinstance(value, bool)
+            ):
+                if not _is_finite(value):
+                    raise TypeError('non finite number {}'.format(value))
+                return value
+            if coercible and isinstance(value, COERCIBLE_VALUES) \
+                    and not isinstance(value, bool) and not (
+                        # Do not truncate fractional numbers into int columns
+                        column_type is int
+                        and isinstance(value, (float, Decimal)) and value % 1
+                    ):
+                try:
+                    value = column_type(value)
+                except (TypeError, ValueError, ArithmeticError):
+                    pass
+                else:
+                    if not _is_finite(value):
+                        raise TypeError(
+                            'non finite number {}'.format(value)
+                        )
+                    return value
+            raise TypeError('expected {}, got {}'.format(
+                column_type.__name__, type(value).__name__
+            ))
+        return check
+
+    def serialize(self, values, partial=False, drop_empty=True):
+        """Validates the values and returns the item to send
+
+        Args:
+            values (dict): Attribute values of the model
+            partial (bool): Skip the required check, for updates
+            drop_empty (bool): Leave out None and empty string values
+
+        Returns:
+            dict: Coerced item with numbers as Decimal
+        """
+
+        errors = dict()
+        item = dict()
+        size = 0
+        checks = self._checks
+        for name, value in values.items():
+            if value is None or value == '':
+                if not drop_empty:
+                    item[name] = value
+                continue
+            check = checks.get(name)
+            if check is not None:
+                try:
+                    value = check(value)
+                except TypeError as err:
+                    errors[name] = str(err)
+                    continue
+            try:
+                value = _to_dynamodb(value)
+            except TypeError as err:
+                errors[name] = str(err)
+                continue
+            item[name] = value
+            size += _str_size(name) + attribute_size(value)
+
+        if not partial:
+            for name in self._required:
+                if name not in item and name not in errors:
+                    errors[name] = 'required'
+
+        if not errors and size > self._max_item_size:
+            errors['item'] = 'size {} bytes above {} bytes'.format(
+                size, self._max_item_size
+            )
+
+        if errors:
+            raise ValidationError(errors)
+        return item
+
+    def validate_many(self, items, partial=False):
+        """Validates a batch of items
+
+        Args:
+            items (list): Dicts of attribute values
+            partial (bool): Skip the required check
+
+        Returns:
+            tuple: (list of serialized items, list of (index,
+            ValidationError) for the rejected ones)
+        """
+
+        valid = []
+        invalid = []
+        serialize = self.serialize
+        for index, values in enumerate(items):
+            try:
+                valid.append(serialize(values, partial=partial))
+            except ValidationError as err:
+                invalid.append((index, err))
+        return valid, invalid
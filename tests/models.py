@@ -0,0 +1,52 @@
+from ddbmodel.ddb import DDBApi
+from ddbmodel.model import Model
+
+
+class User(metaclass=Model):
+    email = Model.Column(str, key_type=Model.Key.PARTITION_KEY)
+    created = Model.Column(int, key_type=Model.Key.SORT_KEY)
+    name = Model.Column(str)
+    age = Model.Column(int)
+
+    DDB_MAX_RETRIES = 0
+    DDB_RETRY_SLEEP_TIME = 1
+    DDB_ENDPOINT_URL = None
+    DbTableName = 'users'
+    AWSRegion = 'us-east-1'
+
+
+class Order(metaclass=Model):
+    customer = Model.Column(str, key_type=Model.Key.PARTITION_KEY)
+    order_id = Model.Column(str, key_type=Model.Key.SORT_KEY)
+    status = Model.Column(str)
+    amount = Model.Column(float)
+
+    orders = Model.Aggregate('count')
+    by_status = Model.Aggregate('count', group_by='status')
+    spend = Model.Aggregate('sum', attribute='amount')
+
+    DDB_MAX_RETRIES = 0
+    DDB_RETRY_SLEEP_TIME = 1
+    DDB_ENDPOINT_URL = None
+    DbTableName = 'orders'
+    AWSRegion = 'us-east-1'
+
+
+class Doc(metaclass=Model):
+    id = Model.Column(str, key_type=Model.Key.PARTITION_KEY)
+    body = Model.Column(str)
+    rev = Model.Column(int, version=True)
+
+    DDB_MAX_RETRIES = 0
+    DDB_RETRY_SLEEP_TIME = 1
+    DDB_ENDPOINT_URL = None
+    DbTableName = 'docs'
+    AWSRegion = 'us-east-1'
+
+
+def adapter_of(model_class):
+    """Returns the DDBApi the generated methods of a model write through"""
+
+    for cell in model_class.save.__wrapped__.__closure__:
+        if isinstance(cell.cell_contents, DDBApi):
+            return cell.cell_contents
@@ -0,0 +1,171 @@
+from decimal import Decimal
+
+import botocore
+import pytest
+
+from ddbmodel import ddb
+from ddbmodel.aggregates import AGGREGATE_KEY, AGGREGATE_VALUE
+from ddbmodel.ddb import DDBApi, DDBError, ModelSettings
+from ddbmodel.model import Model
+from ddbmodel.stream import INSERT, FakeStreamSource
+
+from .models import Order
+
+
+AGGREGATE_ITEM = {
+    'customer': 'AGG#orders#c1', 'order_id': 'AGG',
+    'aggregate_name': 'orders', AGGREGATE_VALUE: 2
+}
+ORDER = {'customer': 'c1', 'order_id': 'o1', 'status': 'new', 'amount': 5}
+
+
+def test_numeric_partition_key_needs_aggregate_table():
+    with pytest.raises(TypeError):
+        class Counter(metaclass=Model):
+            id = Model.Column(int, key_type=Model.Key.PARTITION_KEY)
+            rows = Model.Aggregate('count')
+
+            DDB_MAX_RETRIES = 0
+            DDB_RETRY_SLEEP_TIME = 1
+            DDB_ENDPOINT_URL = None
+            DbTableName = 'counters'
+            AWSRegion = 'us-east-1'
+
+
+def test_aggregate_table_keeps_aggregate_items_apart(monkeypatch):
+    class Counter(metaclass=Model):
+        id = Model.Column(int, key_type=Model.Key.PARTITION_KEY)
+        rows = Model.Aggregate('count')
+
+        DDB_MAX_RETRIES = 0
+        DDB_RETRY_SLEEP_TIME = 1
+        DDB_ENDPOINT_URL = None
+        DbTableName = 'counters'
+        AWSRegion = 'us-east-1'
+        DDB_AGGREGATE_TABLE = 'aggregates'
+
+    updates = []
+
+    def increment(self, key, attribute, delta, set_attributes=None):
+        updates.append((self._settings.DbTableName, key, delta))
+
+    monkeypatch.setattr(DDBApi, 'increment', increment)
+    monkeypatch.setattr(
+        DDBApi, 'add_row', lambda self, item, **kwargs: {}
+    )
+    counter = Counter()
+    counter.id = 7
+    counter.save()
+    assert updates == [('aggregates', {AGGREGATE_KEY: 'AGG#rows#7'}, 1)]
+
+
+def test_write_deltas(monkeypatch):
+    updates = []
+
+    def increment(self, key, attribute, delta, set_attributes=None):
+        updates.append((key['customer'], delta))
+
+    monkeypatch.setattr(DDBApi, 'increment', increment)
+    monkeypatch.setattr(DDBApi, 'add_row', lambda self, item, **kwargs: {
+        'Attributes': dict(ORDER, status='old', amount=Decimal(2))
+    })
+    order = Order()
+    order.populate(**ORDER)
+    order.save()
+
+    assert sorted(updates) == [
+        ('AGG#by_status#new', 1), ('AGG#by_status#old', -1),
+        ('AGG#spend#c1', 3)
+    ]
+
+
+def test_scans_and_queries_skip_aggregate_items(monkeypatch):
+    monkeypatch.setattr(DDBApi, 'fetch_all_rows', lambda self, **kwargs: {
+        'Items': [AGGREGATE_ITEM, ORDER], 'Count': 2
+    })
+    monkeypatch.setattr(
+        DDBApi, 'query_items',
+        lambda self, query_obj: [AGGREGATE_ITEM, ORDER]
+    )
+    monkeypatch.setattr(
+        DDBApi, 'scan_page', lambda self, scan_obj, exclusive_start_key: {
+            'Items': [AGGREGATE_ITEM, ORDER], 'Count': 2
+        }
+    )
+
+    order = Order()
+    assert order.fetch_all_rows()['Items'] == [ORDER]
+    assert order.query_table({}) == [ORDER]
+    assert list(order.paginate_scan(prefetch=0).items()) == [ORDER]
+
+
+def test_change_feed_skips_aggregate_items():
+    source = FakeStreamSource()
+    source.put_record(
+        's1', INSERT, {'customer': 'AGG#orders#c1', 'order_id': 'AGG'},
+        new_image=AGGREGATE_ITEM
+    )
+    source.put_record(
+        's1', INSERT, {'customer': 'c1', 'order_id': 'o1'}, new_image=ORDER
+    )
+    consumer = Order().stream_consumer(source=source)
+    events = []
+    consumer.on_insert(events.extend)
+
+    assert consumer.poll() == 2
+    assert [event.new.customer for event in events] == ['c1']
+    assert consumer.poll() == 0
+
+
+def throttled():
+    return botocore.exceptions.ClientError({'Error': {
+        'Code': 'ThrottlingException', 'Message': 'throttled'
+    }}, 'UpdateItem')
+
+
+def test_increment_retries_throttling(monkeypatch):
+    monkeypatch.setattr(ddb.time, 'sleep', lambda seconds: None)
+    api = DDBApi(ModelSettings(
+        DbTableName='orders', AWSRegion='us-east-1',
+        DDB_MAX_RETRIES=2, DDB_RETRY_SLEEP_TIME=1
+    ))
+    calls = []
+
+    def put_item(*args, **kwargs):
+        calls.append(args)
+        if len(calls) < 3:
+            raise throttled()
+        return {}
+
+    api._put_item = put_item
+    assert api.increment({'customer': 'AGG#orders#c1'}, 'v', 1) == {}
+    assert len(calls) == 3
+
+    calls.clear()
+    api._settings.DDB_MAX_RETRIES = 1
+    with pytest.raises(DDBError, match='ThrottlingException'):
+        api.increment({'customer': 'AGG#orders#c1'}, 'v', 1)
+
+
+def test_failed_aggregate_update_does_not_fail_the_write(monkeypatch):
+    failing = [True]
+    applied = []
+
+    def increment(self, key, attribute, delta, set_attributes=None):
+        if failing[0]:
+            raise DDBError('throttled')
+        applied.append((key['customer'], delta))
+
+    monkeypatch.setattr(DDBApi, 'increment', increment)
+    monkeypatch.setattr(DDBApi, 'add_row', lambda self, item, **kwargs: {})
+    order = Order()
+    order.populate(**ORDER)
+    order.save()
+
+    assert Order().repair_aggregates() == 3
+    failing[0] = False
+    assert Order().repair_aggregates() == 0
+    assert sorted(applied) == [
+        ('AGG#by_status#new', 1), ('AGG#orders#c1', 1), ('AGG#spend#c1', 5)
+    ]
+    assert Order().repair_aggregates() == 0
@@ -0,0 +1,106 @@
+from ddbmodel.ddb import DDBApi, ModelSettings
+from ddbmodel.expressions import (
+    CompiledKeyCondition, CompiledUpdate, ExpressionCache
+)
+
+
+def test_key_condition_partition_only():
+    compiled = CompiledKeyCondition('email')
+    assert compiled.bind('a@x.com') == {
+        'KeyConditionExpression': '#pk = :pk',
+        'ExpressionAttributeNames': {'#pk': 'email'},
+        'ExpressionAttributeValues': {':pk': 'a@x.com'}
+    }
+
+
+def test_key_condition_with_sort_key():
+    compiled = CompiledKeyCondition('email', 'created')
+    assert compiled.bind('a@x.com', 5) == {
+        'KeyConditionExpression': '#pk = :pk AND #sk = :sk',
+        'ExpressionAttributeNames': {'#pk': 'email', '#sk': 'created'},
+        'ExpressionAttributeValues': {':pk': 'a@x.com', ':sk': 5}
+    }
+
+
+def test_key_condition_bind_does_not_share_names():
+    compiled = CompiledKeyCondition('email')
+    compiled.bind('a')['ExpressionAttributeNames']['#x'] = 'x'
+    assert compiled.bind('b')['ExpressionAttributeNames'] == {'#pk': 'email'}
+
+
+def test_update_expression():
+    compiled = CompiledUpdate(['name', 'age', 'my-attr'])
+    assert compiled.expression == 'SET #u0 = :u0, #u1 = :u1, #u2 = :u2'
+    assert compiled.names == {
+        '#u0': 'name', '#u1': 'age', '#u2': 'my-attr'
+    }
+    assert compiled.bind({'age': 3, 'name': 'n', 'my-attr': 'v'}) == {
+        ':u0': 'n', ':u1': 3, ':u2': 'v'
+    }
+
+
+def test_cache_reuses_shapes():
+    cache = ExpressionCache()
+    assert cache.key_condition('email', 'created') is \
+        cache.key_condition('email', 'created')
+    assert cache.key_condition('email') is not \
+        cache.key_condition('email', 'created')
+    assert cache.update({'name': 1, 'age': 2}) is \
+        cache.update({'name': 3, 'age': 4})
+    assert cache.update({'name': 1, 'age': 2}) is not \
+        cache.update({'age': 2, 'name': 1})
+
+
+def test_cache_is_bounded():
+    cache = ExpressionCache(max_size=2)
+    for index in range(5):
+        cache.update({'attr{}'.format(index): index})
+    assert len(cache._updates) <= 2
+
+
+def adapter():
+    api = DDBApi(ModelSettings(
+        DbTableName='users', AWSRegion='us-east-1',
+        DDB_MAX_RETRIES=0, DDB_RETRY_SLEEP_TIME=1
+    ))
+    api.partition_key = 'email'
+    api.sort_key = 'created'
+    return api
+
+
+def test_update_row_sends_compiled_expression():
+    api = adapter()
+    calls = []
+    api._put_item = lambda *args, **kwargs: calls.append((args, kwargs))
+
+    api.update_row({'email': 'a@x.com', 'created': 1, 'name': 'n', 'age': 3})
+    (key, expression, values, names), kwargs = calls[0]
+    assert key == {'email': 'a@x.com', 'created': 1}
+    assert expression == 'SET #u0 = :u0, #u1 = :u1'
+    assert names == {'#u0': 'name', '#u1': 'age'}
+    assert values == {':u0': 'n', ':u1': 3}
+
+
+def test_version_condition_placeholders_do_not_clash():
+    api = adapter()
+    calls = []
+    api._put_item = lambda *args, **kwargs: calls.append((args, kwargs))
+
+    api.update_row(
+        {'email': 'a@x.com', 'created': 1, 'name': 'n', 'rev': 2},
+        version_key='rev'
+    )
+    (key, expression, values, names), kwargs = calls[0]
+    assert expression == 'SET #u0 = :u0, #u1 = :u1'
+    assert kwargs['ConditionExpression'] == '#ver = :ver_expected'
+    assert names == {'#u0': 'name', '#u1': 'rev', '#ver': 'rev'}
+    assert values == {':u0': 'n', ':u1': 3, ':ver_expected': 2}
+
+
+def test_key_condition_of_adapter():
+    api = adapter()
+    assert api.key_condition('a@x.com', sort_key=False) == \
+        CompiledKeyCondition('email').bind('a@x.com')
+    assert api.key_condition('a@x.com', 1)[
+        'ExpressionAttributeValues'
+    ] == {':pk': 'a@x.com', ':sk': 1}
@@ -0,0 +1,211 @@
+import threading
+from decimal import Decimal
+
+import botocore
+import pytest
+
+from ddbmodel.ddb import (
+    DDBApi, DDBError, ModelSettings, VersionConflictError, _ResourceLease
+)
+
+from .models import Doc, User, adapter_of
+
+
+def test_tables_are_per_thread():
+    api = DDBApi(ModelSettings(DbTableName='users', AWSRegion='us-east-1'))
+    tables = [api._table]
+    thread = threading.Thread(target=lambda: tables.append(api._table))
+    thread.start()
+    thread.join()
+
+    assert api._table is tables[0]
+    assert tables[0] is not tables[1]
+    assert tables[0].meta.client is not tables[1].meta.client
+    assert api._client is api._client
+
+
+def test_ended_threads_return_their_table():
+    api = DDBApi(ModelSettings(DbTableName='users', AWSRegion='us-east-1'))
+    tables = []
+    for _ in range(3):
+        thread = threading.Thread(target=lambda: tables.append(api._table))
+        thread.start()
+        thread.join()
+    assert tables[0] is tables[1] is tables[2]
+
+
+def test_save_many_reports_every_failure(monkeypatch):
+    def add_row(self, item, version_key=None, return_values='NONE'):
+        if item['name'] == 'conflict':
+            raise VersionConflictError('conflict', current_item=item)
+        if item['name'] == 'throttled':
+            raise DDBError('Add operation failed')
+        return {}
+
+    monkeypatch.setattr(DDBApi, 'add_row', add_row)
+    users = []
+    for index, name in enumerate(('ok', 'conflict', 'throttled', 'ok')):
+        user = User()
+        user.populate(email='a@x.com', created=index, name=name)
+        users.append(user)
+
+    failed = User().save_many(users)
+    assert [(user.created, type(err)) for user, err in failed] == [
+        (1, VersionConflictError), (2, DDBError)
+    ]
+
+
+class FakeTable:
+
+    def __init__(self):
+        self.calls = []
+        self.errors = []
+        self.stored = None
+
+    def _call(self, operation, params):
+        self.calls.append((operation, params))
+        if self.errors:
+            error = self.errors.pop(0)
+            if error is not None:
+                raise error
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def put_item(self, **params):
+        return self._call('put_item', params)
+
+    def update_item(self, **params):
+        return self._call('update_item', params)
+
+    def get_item(self, **params):
+        self.calls.append(('get_item', params))
+        return {'Item': self.stored} if self.stored else {}
+
+
+def conflict(item=None):
+    response = {'Error': {
+        'Code': 'ConditionalCheckFailedException', 'Message': 'failed'
+    }}
+    if item is not None:
+        response['Item'] = item
+    return botocore.exceptions.ClientError(response, 'PutItem')
+
+
+@pytest.fixture
+def table():
+    api = adapter_of(Doc)
+    table = FakeTable()
+    api._local.lease = _ResourceLease(None, table)
+    yield table
+    del api._local.lease
+
+
+def doc(**values):
+    instance = Doc()
+    instance.populate(**dict({'id': 'd1', 'body': 'mine'}, **values))
+    return instance
+
+
+def test_first_save_requires_a_new_item(table):
+    instance = doc()
+    instance.save()
+
+    (operation, params), = table.calls
+    assert operation == 'put_item'
+    assert params['ConditionExpression'] == 'attribute_not_exists(#ver)'
+    assert params['ExpressionAttributeNames'] == {'#ver': 'rev'}
+    assert 'ExpressionAttributeValues' not in params
+    assert params['ReturnValuesOnConditionCheckFailure'] == 'ALL_OLD'
+    assert params['Item'] == {'id': 'd1', 'body': 'mine', 'rev': 1}
+    assert instance.rev == 1
+
+
+def test_save_checks_and_increments_the_version(table):
+    instance = doc()
+    instance.save()
+    instance.save()
+
+    params = table.calls[1][1]
+    assert params['ConditionExpression'] == '#ver = :ver_expected'
+    assert params['ExpressionAttributeValues'] == {':ver_expected': 1}
+    assert params['Item']['rev'] == 2
+    assert instance.rev == 2
+
+
+def test_update_row_checks_and_increments_the_version(table):
+    instance = doc(rev=4)
+    instance.update_row()
+
+    (operation, params), = table.calls
+    assert operation == 'update_item'
+    assert params['Key'] == {'id': 'd1'}
+    assert params['ConditionExpression'] == '#ver = :ver_expected'
+    assert params['ExpressionAttributeNames']['#ver'] == 'rev'
+    assert params['ExpressionAttributeValues'][':ver_expected'] == 4
+    assert 5 in params['ExpressionAttributeValues'].values()
+    assert params['ReturnValuesOnConditionCheckFailure'] == 'ALL_OLD'
+    assert instance.rev == 5
+
+
+def test_conflict_carries_the_stored_item(table):
+    table.errors = [conflict({
+        'id': {'S': 'd1'}, 'body': {'S': 'theirs'}, 'rev': {'N': '7'}
+    })]
+    instance = doc(rev=3)
+    with pytest.raises(VersionConflictError) as err:
+        instance.save()
+    assert err.value.current_item == {
+        'id': 'd1', 'body': 'theirs', 'rev': Decimal(7)
+    }
+    assert instance.rev == 3
+    assert [operation for operation, _ in table.calls] == ['put_item']
+
+
+def test_conflict_without_item_reads_it(table):
+    table.errors = [conflict()]
+    table.stored = {'id': 'd1', 'rev': Decimal(2)}
+    with pytest.raises(VersionConflictError) as err:
+        doc(rev=1).save()
+    assert err.value.current_item == table.stored
+    assert table.calls[1] == ('get_item', {'Key': {'id': 'd1'}})
+
+
+def test_save_with_merge_retries_on_the_stored_version(table):
+    table.errors = [conflict({
+        'id': {'S': 'd1'}, 'body': {'S': 'theirs'}, 'rev': {'N': '5'}
+    })]
+    merged = []
+
+    def merge(mine, current):
+        merged.append(current.body)
+        mine.body = mine.body + '+' + current.body
+
+    instance = doc(rev=3)
+    instance.save_with_merge(merge)
+
+    assert merged == ['theirs']
+    params = table.calls[1][1]
+    assert params['ExpressionAttributeValues'] == {':ver_expected': 5}
+    assert params['Item'] == {'id': 'd1', 'body': 'mine+theirs', 'rev': 6}
+    assert instance.rev == 6
+
+
+def test_save_with_merge_handles_deleted_items(table):
+    table.errors = [conflict()]
+    merged = []
+    instance = doc(rev=3)
+    instance.save_with_merge(lambda mine, current: merged.append(current))
+
+    assert merged == [None]
+    params = table.calls[-1][1]
+    assert params['ConditionExpression'] == 'attribute_not_exists(#ver)'
+    assert instance.rev == 1
+
+
+def test_save_with_merge_gives_up_after_max_attempts(table):
+    stored = {'id': {'S': 'd1'}, 'rev': {'N': '9'}}
+    table.errors = [conflict(stored), conflict(stored), conflict(stored)]
+    with pytest.raises(VersionConflictError):
+        doc(rev=1).save_with_merge(
+            lambda mine, current: None, max_attempts=2
+        )
+    assert len(table.calls) == 2
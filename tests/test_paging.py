@@ -0,0 +1,133 @@
+import base64
+import gc
+import json
+import threading
+import time
+
+import pytest
+
+from ddbmodel.ddb import DDBError
+from ddbmodel.paging import PagedResult, decode_cursor, encode_cursor
+
+
+class FakeTable:
+
+    def __init__(self, pages=None):
+        self.pages = pages
+        self.fetches = []
+
+    def fetch_page(self, start_key):
+        index = start_key['index'] if start_key else 0
+        self.fetches.append(index)
+        response = {'Items': [index], 'Count': 1, 'ScannedCount': 2}
+        if self.pages is None or index + 1 < self.pages:
+            response['LastEvaluatedKey'] = {'index': index + 1}
+        return response
+
+
+def prefetch_threads():
+    return [
+        thread for thread in threading.enumerate()
+        if getattr(thread, '_target', None) is not None
+        and thread._target.__module__ == 'ddbmodel.paging'
+    ]
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_single_page_reads_once_without_thread():
+    table = FakeTable()
+    for _ in range(5):
+        page = PagedResult(table.fetch_page).next_page()
+        assert page.items == [0] and page.has_more
+    assert table.fetches == [0] * 5
+    assert prefetch_threads() == []
+
+
+def test_iterates_every_page_in_order():
+    table = FakeTable(pages=5)
+    result = PagedResult(table.fetch_page, prefetch=2)
+    assert list(result.items()) == [0, 1, 2, 3, 4]
+    assert table.fetches == [0, 1, 2, 3, 4]
+    assert result.pages_read == 5
+    assert result.scanned_count == 10
+    assert result.next_page() is None
+
+
+def test_resumes_from_cursor():
+    table = FakeTable(pages=3)
+    page = PagedResult(table.fetch_page).next_page()
+    result = PagedResult(table.fetch_page, cursor=page.cursor)
+    assert list(result.items()) == [1, 2]
+
+
+def test_close_stops_the_worker():
+    table = FakeTable()
+    result = PagedResult(table.fetch_page, prefetch=1)
+    result.next_page()
+    result.next_page()
+    assert len(prefetch_threads()) == 1
+    result.close()
+    assert wait_for(lambda: not prefetch_threads())
+    assert result.next_page() is None
+
+
+def test_garbage_collection_stops_the_worker():
+    table = FakeTable()
+    result = PagedResult(table.fetch_page, prefetch=1)
+    result.next_page()
+    result.next_page()
+    del result
+    gc.collect()
+    assert wait_for(lambda: not prefetch_threads())
+    # Served two pages, read at most two ahead
+    assert len(table.fetches) <= 4
+
+
+def test_worker_errors_reach_the_caller():
+    calls = []
+
+    def fetch_page(start_key):
+        calls.append(start_key)
+        if len(calls) > 1:
+            raise RuntimeError('read failed')
+        return {'Items': [], 'LastEvaluatedKey': {'index': 1}}
+
+    result = PagedResult(fetch_page)
+    result.next_page()
+    try:
+        result.next_page()
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError('error not raised')
+    assert result.next_page() is None
+
+
+def test_cursor_round_trip():
+    key = {'pk': 'a', 'sk': 5, 'bin': b'\x00\x01'}
+    assert decode_cursor(encode_cursor(key)) == key
+    assert encode_cursor(None) is None and decode_cursor(None) is None
+
+
+@pytest.mark.parametrize('key', [
+    [1, 2], {'a': 'x'}, {'a': {'Q': '1'}}, {'a': {'N': 'abc'}},
+    {'a': {'S': 1}}, {'a': {'S': 'x', 'N': '1'}}, {'a': {'B': '%%'}},
+    {'a': {'M': {}}}, {}, 'text', None
+])
+def test_invalid_cursors_raise_ddb_error(key):
+    cursor = base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+    with pytest.raises(DDBError, match='Invalid pagination cursor'):
+        decode_cursor(cursor)
+
+
+def test_undecodable_cursor_raises_ddb_error():
+    with pytest.raises(DDBError):
+        decode_cursor('not base64 !')
+    with pytest.raises(DDBError):
+        decode_cursor('é')
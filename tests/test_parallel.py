@@ -0,0 +1,164 @@
+import multiprocessing
+import os
+import pickle
+
+import pytest
+
+from ddbmodel import ddb
+from ddbmodel.ddb import DDBApi
+from ddbmodel.parallel import fetch_keys_parallel, parallel_scan
+from ddbmodel.routing import ReplicaRouter, _reset_routers_after_fork
+
+from .models import User, adapter_of
+
+
+fork_only = pytest.mark.skipif(
+    multiprocessing.get_start_method() != 'fork',
+    reason='patched adapters only reach forked workers'
+)
+
+
+def user(**values):
+    instance = User()
+    instance.populate(**dict(
+        {'email': 'a@x.com', 'created': 1, 'name': 'n'}, **values
+    ))
+    return instance
+
+
+def test_models_pickle_by_reference():
+    assert pickle.loads(pickle.dumps(User)) is User
+
+    instance = pickle.loads(pickle.dumps(user(age=30)))
+    assert isinstance(instance, User)
+    assert instance.to_dict() == {
+        'email': 'a@x.com', 'created': 1, 'name': 'n', 'age': 30
+    }
+
+    to_dict = pickle.loads(pickle.dumps(user(name='m').to_dict))
+    assert to_dict()['name'] == 'm'
+    assert pickle.loads(pickle.dumps(User.save)) is User.save
+
+
+def test_adapter_pickles_without_connection():
+    api = adapter_of(User)
+    api._client
+    api._table
+    state = api.__getstate__()
+    assert state['_connection'] is None and state['_local'] is None
+
+    copy = pickle.loads(pickle.dumps(api))
+    assert copy._connection is None
+    assert getattr(copy._local, 'lease', None) is None
+    assert (copy.partition_key, copy.sort_key) == ('email', 'created')
+    assert copy._settings.DbTableName == 'users'
+    assert copy.key_condition('a', 1) == api.key_condition('a', 1)
+    assert copy in ddb._ADAPTERS
+
+
+def test_fork_hook_resets_adapters():
+    api = adapter_of(User)
+    client = api._client
+    api._table
+    ddb._reset_adapters_after_fork()
+    assert api._connection is None
+    assert getattr(api._local, 'lease', None) is None
+    assert api._client is not client
+
+
+def test_fork_hook_resets_routers():
+    router = ReplicaRouter([adapter_of(User), adapter_of(User)])
+    executor = router._get_executor()
+    lock = router._lock
+    router._method_tracker(0, 'get_item')
+    _reset_routers_after_fork()
+    assert router._executor is None and router._lock is not lock
+    assert router._get_executor() is not executor
+    executor.shutdown()
+    router._executor.shutdown()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_forked_child_builds_its_own_client():
+    api = adapter_of(User)
+    parent_client = id(api._client)
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            reset = api._connection is None
+            rebuilt = id(api._client) != parent_client
+            os.write(write, b'1' if reset and rebuilt else b'0')
+        finally:
+            os._exit(0)
+    os.close(write)
+    result = os.read(read, 1)
+    os.close(read)
+    os.waitpid(pid, 0)
+    assert result == b'1'
+    assert id(api._client) == parent_client
+
+
+def batch_get_item(self, request_items, return_consumed_capacity='NONE'):
+    keys = request_items['users']['Keys']
+    return [{'users': [
+        dict(key, name=str(os.getpid()), age=len(keys)) for key in keys
+    ]}]
+
+
+def scan_page(self, scan_obj, exclusive_start_key=None):
+    segment = scan_obj['Segment']
+    page = exclusive_start_key['page'] if exclusive_start_key else 0
+    response = {
+        'Items': [{
+            'email': 's{}-p{}'.format(segment, page),
+            'created': scan_obj['TotalSegments'],
+            'age': scan_obj['Limit']
+        }],
+        'Count': 1
+    }
+    if page == 0:
+        response['LastEvaluatedKey'] = {'page': 1}
+    return response
+
+
+def email(item):
+    return item['email']
+
+
+@fork_only
+def test_fetch_keys_parallel_chunks_in_order(monkeypatch):
+    monkeypatch.setattr(DDBApi, 'batch_get_item', batch_get_item)
+    keys = [{'email': str(index), 'created': index} for index in range(250)]
+
+    items = fetch_keys_parallel(User, keys, processes=2)
+    assert [item['created'] for item in items] == list(range(250))
+    assert [item['age'] for item in items[::50]] == [100, 100, 100, 100, 50]
+    assert {item['name'] for item in items} - {str(os.getpid())}
+
+    models = fetch_keys_parallel(
+        User, keys[:5], processes=2, chunk_size=2, as_models=True
+    )
+    assert [model.created for model in models] == [0, 1, 2, 3, 4]
+    assert [model.age for model in models] == [2, 2, 2, 2, 1]
+
+    assert fetch_keys_parallel(User, [], processes=2) == []
+
+
+@fork_only
+def test_parallel_scan_reads_every_segment_in_order(monkeypatch):
+    monkeypatch.setattr(DDBApi, 'scan_page', scan_page)
+
+    items = parallel_scan(User, total_segments=3, processes=2, page_size=7)
+    assert [item['email'] for item in items] == [
+        's0-p0', 's0-p1', 's1-p0', 's1-p1', 's2-p0', 's2-p1'
+    ]
+    assert {(item['created'], item['age']) for item in items} == {(3, 7)}
+
+    emails = parallel_scan(
+        User, total_segments=2, processes=2, decode=email
+    )
+    assert emails == ['s0-p0', 's0-p1', 's1-p0', 's1-p1']
+
+    models = parallel_scan(User, total_segments=1, as_models=True)
+    assert [model.email for model in models] == ['s0-p0', 's0-p1']
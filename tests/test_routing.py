@@ -0,0 +1,129 @@
+import threading
+import time
+
+from ddbmodel.routing import LatencyTracker, ReplicaRouter
+
+
+class FakeReplica:
+
+    def __init__(self, name, delay=0.0, delays=None):
+        self.name = name
+        self.delay = delay
+        self.delays = delays or {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _call(self, method_name, query_obj):
+        with self.lock:
+            self.calls.append(method_name)
+        time.sleep(self.delays.get(method_name, self.delay))
+        return self.name
+
+    def get_item(self, key):
+        return self._call('get_item', key)
+
+    def scan_page(self, scan_obj, exclusive_start_key=None):
+        return self._call('scan_page', scan_obj)
+
+    def query_page(self, query_obj, exclusive_start_key=None):
+        query_obj['ExclusiveStartKey'] = self.name
+        return self._call('query_page', query_obj)
+
+    def query_items(self, query_obj):
+        query_obj['ExclusiveStartKey'] = self.name
+        return self._call('query_items', query_obj)
+
+    def add_row(self, item):
+        return self._call('add_row', item)
+
+
+def warmed_router(replicas, samples=20, methods=('query_page',),
+                  **kwargs):
+    router = ReplicaRouter(replicas, **kwargs)
+    for index, replica in enumerate(replicas):
+        for _ in range(samples):
+            router._trackers[index].record(replica.delay or 0.001)
+            for method_name in methods:
+                router._method_tracker(index, method_name).record(
+                    replica.delays.get(method_name, replica.delay) or 0.001
+                )
+    return router
+
+
+def test_reads_go_to_fastest_replica():
+    fast = FakeReplica('fast', 0.001)
+    slow = FakeReplica('slow', 0.05)
+    router = warmed_router([slow, fast], probe_rate=0)
+    assert router.query_page({}) == 'fast'
+    assert slow.calls == []
+
+
+def test_writes_stay_on_home():
+    home = FakeReplica('home', 0.05)
+    other = FakeReplica('other', 0.001)
+    router = warmed_router([home, other])
+    assert router.add_row({}) == 'home'
+
+
+def test_hedged_attempts_get_their_own_arguments():
+    slow = FakeReplica('slow', 0.01)
+    fast = FakeReplica('fast', 0.01)
+    router = warmed_router([slow, fast], hedge_percentile=50, probe_rate=0)
+    slow.delay = 0.2
+    query_obj = {'Limit': 10}
+
+    assert router.query_page(query_obj) == 'fast'
+    assert query_obj == {'Limit': 10}
+    assert slow.calls == ['query_page'] and fast.calls == ['query_page']
+
+
+def test_paginating_reads_are_not_hedged():
+    slow = FakeReplica('slow', 0.01)
+    fast = FakeReplica('fast', 0.01)
+    router = warmed_router([slow, fast], hedge_percentile=50, probe_rate=0)
+    slow.delay = 0.05
+
+    assert router.query_items({}) == 'slow'
+    assert fast.calls == []
+
+
+def test_probes_remeasure_every_replica():
+    replicas = [FakeReplica(name) for name in ('a', 'b', 'c')]
+    router = warmed_router(replicas, probe_rate=0.2)
+    # One spike left b and c behind a
+    router._trackers[1].record(5.0)
+    router._trackers[2].record(5.0)
+
+    for _ in range(200):
+        router.query_page({})
+    assert all(replica.calls for replica in replicas[1:])
+    assert len(replicas[0].calls) > len(replicas[1].calls)
+
+
+def test_estimate_decays_towards_recent_samples():
+    tracker = LatencyTracker(alpha=0.5)
+    tracker.record(1.0)
+    for _ in range(10):
+        tracker.record(0.01)
+    assert tracker.estimate < 0.02
+
+
+def test_hedge_threshold_is_per_method():
+    home = FakeReplica('home', delays={'get_item': 0.005, 'scan_page': 0.1})
+    other = FakeReplica('other', delays={'get_item': 0.005, 'scan_page': 0.1})
+    router = ReplicaRouter([home, other], hedge_percentile=90, probe_rate=0)
+    for _ in range(10):
+        router._timed_call(0, 'get_item', ({},), {})
+        router._timed_call(0, 'scan_page', ({},), {})
+    other.calls.clear()
+    router._trackers[1].record(1.0)
+
+    # A scan within the usual scan latency is not hedged
+    home.delays['scan_page'] = 0.05
+    assert router.scan_page({}) == 'home'
+    assert other.calls == []
+
+    # A get as slow as a scan is
+    home.delays['get_item'] = 0.1
+    assert router.get_item({}) == 'other'
+    assert other.calls == ['get_item']
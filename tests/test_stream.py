@@ -0,0 +1,294 @@
+import threading
+import time
+
+import pytest
+from botocore.stub import Stubber
+
+from ddbmodel.ddb import DDBError
+from ddbmodel.stream import (
+    INSERT, MODIFY, REMOVE, DDBStreamSource, FakeStreamSource,
+    ShardCheckpoint, StreamConsumer
+)
+
+from .models import User
+
+
+def user(name, age=30):
+    return {'email': 'a@x.com', 'created': 1, 'name': name, 'age': age}
+
+
+KEYS = {'email': 'a@x.com', 'created': 1}
+
+
+def cache_consumer(source, **kwargs):
+    consumer = StreamConsumer(User, source, **kwargs)
+    cache = dict()
+    calls = []
+
+    def upsert(events):
+        calls.append((events[0].event_name, len(events)))
+        for event in events:
+            cache[event.new.email] = event.new.name
+
+    def remove(events):
+        calls.append((events[0].event_name, len(events)))
+        for event in events:
+            cache.pop(event.keys['email'], None)
+
+    consumer.on_insert(upsert)
+    consumer.on_modify(upsert)
+    consumer.on_remove(remove)
+    return consumer, cache, calls
+
+
+def test_events_keep_shard_order():
+    source = FakeStreamSource()
+    source.put_record('s1', MODIFY, KEYS, user('b'), user('a'))
+    source.put_record('s1', REMOVE, KEYS, old_image=user('b'))
+    source.put_record('s1', INSERT, KEYS, new_image=user('c'))
+    consumer, cache, calls = cache_consumer(source)
+
+    assert consumer.poll() == 3
+    assert cache == {'a@x.com': 'c'}
+    assert calls == [(MODIFY, 1), (REMOVE, 1), (INSERT, 1)]
+
+
+def test_consecutive_events_are_batched():
+    source = FakeStreamSource()
+    for name in ('a', 'b', 'c'):
+        source.put_record('s1', INSERT, KEYS, new_image=user(name))
+    source.put_record('s1', REMOVE, KEYS, old_image=user('c'))
+    consumer, cache, calls = cache_consumer(source)
+
+    consumer.poll()
+    assert calls == [(INSERT, 3), (REMOVE, 1)]
+    assert cache == {}
+
+
+def test_events_decode_into_models():
+    source = FakeStreamSource()
+    source.put_record('s1', MODIFY, KEYS, user('b', 31), user('a', 30))
+    consumer = StreamConsumer(User, source)
+    events = []
+    consumer.on_modify(events.extend)
+
+    consumer.poll()
+    event, = events
+    assert isinstance(event.new, User)
+    assert (event.old.name, event.new.name) == ('a', 'b')
+    assert event.new.age == 31
+    assert event.keys == KEYS
+
+
+def test_checkpoint_resume(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    source = FakeStreamSource()
+    source.put_record('s1', INSERT, KEYS, new_image=user('a'))
+    consumer, cache, calls = cache_consumer(
+        source, checkpoint=ShardCheckpoint(path)
+    )
+    assert consumer.poll() == 1
+
+    # A new consumer only reads the records after the checkpoint
+    source.put_record('s1', MODIFY, KEYS, user('b'), user('a'))
+    consumer, cache, calls = cache_consumer(
+        source, checkpoint=ShardCheckpoint(path)
+    )
+    assert consumer.poll() == 1
+    assert calls == [(MODIFY, 1)]
+    assert consumer.poll() == 0
+
+
+def test_checkpoint_waits_for_failed_handler():
+    source = FakeStreamSource()
+    source.put_record('s1', INSERT, KEYS, new_image=user('a'))
+    consumer = StreamConsumer(User, source)
+    seen = []
+
+    def handler(events):
+        seen.extend(events)
+        if len(seen) == 1:
+            raise RuntimeError('handler failed')
+
+    consumer.on_insert(handler)
+    try:
+        consumer.poll()
+    except RuntimeError:
+        pass
+    assert consumer.poll() == 1
+    assert len(seen) == 2
+
+
+def test_child_shard_waits_for_parent():
+    source = FakeStreamSource()
+    source.add_shard('parent')
+    source.add_shard('child', parent_shard_id='parent')
+    source.put_record('parent', INSERT, KEYS, new_image=user('a'))
+    source.put_record('child', MODIFY, KEYS, user('b'), user('a'))
+    consumer, cache, calls = cache_consumer(source, batch_size=10)
+
+    # Parent still open, the child is not read
+    assert consumer.poll() == 1
+    assert calls == [(INSERT, 1)]
+
+    source.close_shard('parent')
+    assert consumer.poll() == 0
+    assert consumer.poll() == 1
+    assert calls == [(INSERT, 1), (MODIFY, 1)]
+    assert cache == {'a@x.com': 'b'}
+
+
+def test_handlers_are_not_called_concurrently():
+    source = FakeStreamSource()
+    for shard_id in ('s1', 's2', 's3', 's4'):
+        source.put_record(shard_id, INSERT, KEYS, new_image=user(shard_id))
+    consumer = StreamConsumer(User, source, max_workers=4)
+    lock = threading.Lock()
+    active = []
+    overlaps = []
+
+    def handler(events):
+        with lock:
+            active.append(1)
+            overlaps.append(len(active))
+        time.sleep(0.01)
+        with lock:
+            active.pop()
+
+    consumer.on_insert(handler)
+    assert consumer.poll() == 4
+    assert max(overlaps) == 1
+
+
+class FakeAdapter:
+
+    class _settings:
+        AWSRegion = 'us-east-1'
+
+    def get_stream_arn(self):
+        return 'arn:aws:dynamodb:us-east-1:1:table/users/stream/1'
+
+
+SHARD_ID = 'shardId-00000001536019433488-a1b2c3d4'
+
+
+def stream_record(sequence_number):
+    sequence_number = '{:021d}'.format(sequence_number)
+    return {
+        'eventID': sequence_number,
+        'eventName': INSERT,
+        'dynamodb': {
+            'Keys': {'email': {'S': 'a@x.com'}, 'created': {'N': '1'}},
+            'NewImage': {'email': {'S': 'a@x.com'}, 'created': {'N': '1'}},
+            'SequenceNumber': sequence_number
+        }
+    }
+
+
+def test_expired_iterator_restarts_from_checkpoint():
+    source = DDBStreamSource(FakeAdapter())
+    arn = FakeAdapter().get_stream_arn()
+    stubber = Stubber(source._client)
+    stubber.add_response(
+        'get_shard_iterator', {'ShardIterator': 'it-1'},
+        {'StreamArn': arn, 'ShardId': SHARD_ID,
+         'ShardIteratorType': 'TRIM_HORIZON'}
+    )
+    stubber.add_response(
+        'get_records',
+        {'Records': [stream_record(100)], 'NextShardIterator': 'it-2'},
+        {'ShardIterator': 'it-1', 'Limit': 100}
+    )
+    stubber.add_client_error(
+        'get_records', service_error_code='ExpiredIteratorException',
+        expected_params={'ShardIterator': 'it-2', 'Limit': 100}
+    )
+    stubber.add_response(
+        'get_shard_iterator', {'ShardIterator': 'it-3'},
+        {'StreamArn': arn, 'ShardId': SHARD_ID,
+         'ShardIteratorType': 'AFTER_SEQUENCE_NUMBER',
+         'SequenceNumber': '{:021d}'.format(100)}
+    )
+    stubber.add_response(
+        'get_records',
+        {'Records': [stream_record(101)], 'NextShardIterator': 'it-4'},
+        {'ShardIterator': 'it-3', 'Limit': 100}
+    )
+
+    consumer = StreamConsumer(User, source)
+    consumer._readable_shards = lambda: [SHARD_ID]
+    sequence_numbers = []
+    consumer.on_insert(lambda events: sequence_numbers.extend(
+        event.sequence_number for event in events
+    ))
+    with stubber:
+        assert consumer.poll() == 1
+        assert consumer.poll() == 0
+        assert consumer.poll() == 1
+    stubber.assert_no_pending_responses()
+    assert [int(number) for number in sequence_numbers] == [100, 101]
+
+
+def test_failed_handler_rereads_from_checkpoint():
+    source = DDBStreamSource(FakeAdapter())
+    arn = FakeAdapter().get_stream_arn()
+    trim_horizon = {
+        'StreamArn': arn, 'ShardId': SHARD_ID,
+        'ShardIteratorType': 'TRIM_HORIZON'
+    }
+    stubber = Stubber(source._client)
+    stubber.add_response(
+        'get_shard_iterator', {'ShardIterator': 'it-1'}, trim_horizon
+    )
+    stubber.add_response(
+        'get_records',
+        {'Records': [stream_record(100)], 'NextShardIterator': 'it-2'},
+        {'ShardIterator': 'it-1', 'Limit': 100}
+    )
+    # The handler failed, the shard is read again from the start
+    stubber.add_response(
+        'get_shard_iterator', {'ShardIterator': 'it-3'}, trim_horizon
+    )
+    stubber.add_response(
+        'get_records',
+        {'Records': [stream_record(100)], 'NextShardIterator': 'it-4'},
+        {'ShardIterator': 'it-3', 'Limit': 100}
+    )
+    # Checkpointed, the cached iterator is reused
+    stubber.add_response(
+        'get_records',
+        {'Records': [stream_record(101)], 'NextShardIterator': 'it-5'},
+        {'ShardIterator': 'it-4', 'Limit': 100}
+    )
+
+    consumer = StreamConsumer(User, source)
+    consumer._readable_shards = lambda: [SHARD_ID]
+    sequence_numbers = []
+
+    def handler(events):
+        if not sequence_numbers:
+            sequence_numbers.append(None)
+            raise RuntimeError('handler failed')
+        sequence_numbers.extend(event.sequence_number for event in events)
+
+    consumer.on_insert(handler)
+    with stubber:
+        with pytest.raises(RuntimeError):
+            consumer.poll()
+        assert consumer._checkpoint.get(SHARD_ID) is None
+        assert consumer.poll() == 1
+        assert consumer.poll() == 1
+    stubber.assert_no_pending_responses()
+    assert [int(number) for number in sequence_numbers[1:]] == [100, 101]
+    assert int(consumer._checkpoint.get(SHARD_ID)) == 101
+
+
+def test_stream_errors_raise_ddb_error():
+    source = DDBStreamSource(FakeAdapter())
+    stubber = Stubber(source._client)
+    stubber.add_response('get_shard_iterator', {'ShardIterator': 'it-1'})
+    stubber.add_client_error(
+        'get_records', service_error_code='ResourceNotFoundException'
+    )
+    with stubber, pytest.raises(DDBError, match='ResourceNotFound'):
+        source.read_shard(SHARD_ID)
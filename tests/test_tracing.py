@@ -0,0 +1,155 @@
+import json
+import logging
+
+import boto3
+import pytest
+from botocore.awsrequest import AWSResponse
+
+from ddbmodel.ddb import _ResourceLease
+from ddbmodel.tracing import (
+    CallbackExporter, InMemoryExporter, instrument_client, traced, tracer
+)
+
+from .models import User, adapter_of
+
+
+@pytest.fixture
+def spans():
+    exporter = InMemoryExporter()
+    tracer.configure(enabled=True, sample_rate=1.0, exporters=[exporter])
+    yield exporter
+    tracer.configure(enabled=False, sample_rate=1.0, exporters=[])
+    tracer._local.stack = []
+
+
+@traced('work')
+def work(fail=False):
+    with tracer.span('inner', step=1):
+        if fail:
+            raise ValueError('bad input')
+        return 'done'
+
+
+def test_disabled_tracer_creates_no_spans():
+    exporter = InMemoryExporter()
+    tracer.configure(enabled=False, exporters=[exporter])
+    try:
+        assert work() == 'done'
+    finally:
+        tracer.configure(enabled=False, exporters=[])
+    assert exporter.spans == []
+    assert tracer.current_span() is None
+
+
+def test_spans_nest_under_the_active_span(spans):
+    assert work() == 'done'
+    inner, outer = spans.spans
+    assert (outer.name, inner.name) == ('work', 'inner')
+    assert outer.parent_id is None
+    assert inner.parent_id == outer.span_id
+    assert inner.trace_id == outer.trace_id
+    assert inner.attributes == {'step': 1}
+    assert outer.duration >= inner.duration
+    assert tracer._local.stack == []
+
+
+def test_exceptions_are_recorded(spans):
+    with pytest.raises(ValueError):
+        work(fail=True)
+    inner, outer = spans.spans
+    assert 'bad input' in inner.error and 'bad input' in outer.error
+    assert tracer._local.stack == []
+
+
+def test_unsampled_roots_leave_no_spans(spans):
+    tracer.sample_rate = 0
+    for _ in range(5):
+        assert work() == 'done'
+    assert spans.spans == []
+    assert tracer._local.stack == []
+
+
+def test_failing_exporter_is_logged(spans, caplog):
+    received = []
+
+    def fail(span):
+        raise RuntimeError('exporter down')
+
+    tracer.exporters = [CallbackExporter(fail), CallbackExporter(
+        received.append
+    )]
+    with caplog.at_level(logging.ERROR, logger='ddbmodel.tracing'):
+        assert work() == 'done'
+    assert [span.name for span in received] == ['inner', 'work']
+    assert 'Span exporter failed' in caplog.text
+
+
+class FakeTable:
+
+    def put_item(self, **params):
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+
+def test_model_methods_nest_adapter_spans(spans):
+    api = adapter_of(User)
+    api._local.lease = _ResourceLease(None, FakeTable())
+    try:
+        user = User()
+        user.populate(email='a@x.com', created=1, name='n')
+        user.save()
+    finally:
+        del api._local.lease
+
+    by_name = {span.name: span for span in spans.spans}
+    save = by_name['User.save']
+    add_row = by_name['DDBApi.add_row']
+    assert save.parent_id is None
+    assert by_name['User.to_dict'].parent_id == save.span_id
+    assert add_row.parent_id == save.span_id
+    assert by_name['DDBApi.del_empty_key_values'].parent_id == \
+        add_row.span_id
+    # populate ran before save as a trace of its own
+    assert by_name['User.populate'].parent_id is None
+    assert {
+        span.trace_id for span in spans.spans
+        if span.name != 'User.populate'
+    } == {save.trace_id}
+
+
+class RawBody:
+
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+    def read(self, *args):
+        return self.body
+
+
+def fake_send(request, **kwargs):
+    body = json.dumps({'Item': {'id': {'S': '1'}}}).encode()
+    return AWSResponse(request.url, 200, {}, RawBody(body))
+
+
+def test_boto3_calls_are_split_into_stages(spans, monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'key')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'secret')
+    client = boto3.client('dynamodb', region_name='us-east-1')
+    instrument_client(client)
+    client.meta.events.register_last('before-send.dynamodb', fake_send)
+
+    with tracer.span('call') as call:
+        response = client.get_item(TableName='t', Key={'id': {'S': '1'}})
+    assert response['Item'] == {'id': {'S': '1'}}
+
+    names = [span.name for span in spans.spans]
+    assert names == [
+        'boto3.serialize', 'boto3.network', 'boto3.deserialize', 'call'
+    ]
+    assert all(
+        span.parent_id == call.span_id for span in spans.spans[:-1]
+    )
+    assert tracer._local.boto_span is None
+    assert tracer._local.stack == []
@@ -0,0 +1,110 @@
+from decimal import Decimal
+
+import pytest
+
+from ddbmodel.validation import (
+    MAX_ITEM_SIZE, ModelValidator, ValidationError, attribute_size, item_size
+)
+
+
+def validator(**kwargs):
+    return ModelValidator(
+        {'pk': str, 'count': int, 'amount': float, 'flag': bool,
+         'tags': list, 'data': None},
+        required=('pk',),
+        **kwargs
+    )
+
+
+def test_coerces_compatible_values():
+    item = validator().serialize(
+        {'pk': 'a', 'count': '5', 'amount': 1.5, 'tags': ['x']}
+    )
+    assert item == {
+        'pk': 'a', 'count': 5, 'amount': Decimal('1.5'), 'tags': ['x']
+    }
+
+
+@pytest.mark.parametrize('name', ['count', 'amount', 'pk'])
+def test_rejects_bool_for_other_types(name):
+    with pytest.raises(ValidationError) as err:
+        validator().serialize({'pk': 'a', name: True})
+    assert err.value.errors == {name: 'expected {}, got bool'.format(
+        {'count': 'int', 'amount': 'float', 'pk': 'str'}[name]
+    )}
+
+
+def test_accepts_bool_for_bool_columns():
+    assert validator().serialize({'pk': 'a', 'flag': False}) == {
+        'pk': 'a', 'flag': False
+    }
+
+
+def test_does_not_truncate_fractions_into_int():
+    with pytest.raises(ValidationError):
+        validator().serialize({'pk': 'a', 'count': 1.5})
+
+
+def test_required_and_partial():
+    with pytest.raises(ValidationError) as err:
+        validator().serialize({'count': 1})
+    assert err.value.errors == {'pk': 'required'}
+    assert validator().serialize({'count': 1}, partial=True) == {'count': 1}
+
+
+def test_drop_empty():
+    values = {'pk': 'a', 'data': None, 'tags': ''}
+    assert validator().serialize(values) == {'pk': 'a'}
+    assert validator().serialize(values, drop_empty=False) == values
+
+
+def test_item_size_limit():
+    with pytest.raises(ValidationError) as err:
+        validator().serialize({'pk': 'a', 'data': 'x' * MAX_ITEM_SIZE})
+    assert 'item' in err.value.errors
+
+
+def test_sizes():
+    assert attribute_size('abc') == 3
+    assert attribute_size('é') == 2
+    assert attribute_size(True) == 1
+    assert attribute_size(b'\x00' * 4) == 4
+    assert attribute_size({'a': 'bc'}) == 3 + 1 + 2 + 1
+    assert item_size({'pk': 'a', 'n': 12345}) == 2 + 1 + 1 + 4
+
+
+def test_validate_many_reports_rejected_items():
+    valid, invalid = validator().validate_many([
+        {'pk': 'a', 'count': 1},
+        {'pk': 'b', 'count': True},
+        {'count': 2},
+    ])
+    assert valid == [{'pk': 'a', 'count': 1}]
+    assert [(index, err.errors) for index, err in invalid] == [
+        (1, {'count': 'expected int, got bool'}),
+        (2, {'pk': 'required'}),
+    ]
+
+
+@pytest.mark.parametrize('values', [
+    {'amount': float('nan')},
+    {'amount': float('inf')},
+    {'amount': 'inf'},
+    {'amount': Decimal('NaN')},
+    {'data': float('-inf')},
+    {'data': {'nested': [1, float('nan')]}},
+    {'data': {float('inf')}},
+])
+def test_rejects_non_finite_numbers(values):
+    with pytest.raises(ValidationError) as err:
+        validator().serialize(dict(values, pk='a'))
+    name, = values
+    assert 'non finite number' in err.value.errors[name]
+
+
+def test_converts_floats_in_sets():
+    item = validator().serialize({'pk': 'a', 'data': {1.5, 2.5}})
+    assert item['data'] == {Decimal('1.5'), Decimal('2.5')}
+    assert all(isinstance(value, Decimal) for value in item['data'])
+    item = validator().serialize({'pk': 'a', 'data': frozenset([0.5])})
+    assert item['data'] == frozenset([Decimal('0.5')])